@@ -15,6 +15,8 @@ import pandas as pd
 from cdrhelper.generator import *
 from cdrhelper.legacy import *
 from cdrhelper.misc import *
+from cdrhelper.cache import *
+from cdrhelper.rawfile import *
 from cdrhelper.importer import *
 from cdrhelper.analyze import *
 
@@ -2,10 +2,18 @@
 Tools to help analyze fake CDR data as well as networks in general.
 
 """
-from legacy import *
-import networkx as nx
+import os
+import shutil
+import tempfile
+import multiprocessing
+from cdrhelper.legacy import *
+from cdrhelper.importer import EdgeArrays, WEIGHTS, importCalls, _reduceEdges
+from cdrhelper.misc import _shareArray, _loadShared
+from cdrhelper.generator import EARTH_RADIUS, PostcodeSampler
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
 
 def overlap(G, edge):
     """Calculate edge overlap between any two nodes.
@@ -34,12 +42,218 @@ def overlap(G, edge):
     else:
         return None
 
-def overlapDistribution(G, nodelist = None, sort = True):
+def _adjacency(G, directed = False):
+    """Returns the node ids and the binary, symmetric CSR adjacency of G.
+    
+    G can be a NetworkX graph, EdgeArrays or a scipy sparse matrix. Self-loops
+    are kept (on the diagonal); weights are ignored, and so are directions 
+    unless directed is True (then the matrix is not made symmetric).
+    """
+    if isinstance(G, EdgeArrays):
+        nodes, u, v = G.nodes, G.row, G.col
+    elif sp.issparse(G):
+        C = sp.coo_matrix(G)
+        nodes, u, v = np.arange(C.shape[0]), C.row, C.col
+    else:
+        nodes = list(G)
+        index = dict(zip(nodes, range(len(nodes))))
+        uv = np.array([(index[a], index[b]) for a, b in G.edges()], 
+                      dtype = np.int64).reshape(-1, 2)
+        nodes, u, v = np.asarray(nodes), uv[:, 0], uv[:, 1]
+    n = len(nodes)
+    if directed:
+        A = sp.csr_matrix((np.ones(len(u), dtype = np.int8), (u, v)), 
+                          shape = (n, n))
+    else:
+        A = sp.csr_matrix((np.ones(2 * len(u), dtype = np.int8), 
+                           (np.r_[u, v], np.r_[v, u])), shape = (n, n))
+    A.sum_duplicates()
+    A.data[:] = 1
+    A.sort_indices()
+    return nodes, A
+
+def _adjacencyKeys(indptr, indices):
+    """Returns the sorted row * n + col keys of all the CSR entries."""
+    n = len(indptr) - 1
+    return np.repeat(np.arange(n, dtype = np.int64), np.diff(indptr)) * n + \
+        indices
+
+def _commonNeighbors(indptr, indices, keys, i, j, budget = 2 ** 24):
+    """Returns the number of common neighbors of each (i, j) edge.
+    
+    Sorted-adjacency intersection on the CSR arrays of the adjacency: the 
+    neighbors k of the endpoint s with the smaller degree are looked up as 
+    (t, k), t the other endpoint, in keys (see _adjacencyKeys()). Edges are
+    ordered by t so that the lookups mostly go forward through keys. Edges 
+    are done in batches of about budget lookups.
+    """
+    n = len(indptr) - 1
+    count = np.diff(indptr)
+    small = count[i] <= count[j]
+    s, t = np.where(small, i, j), np.where(small, j, i)
+    order = np.argsort(t, kind = 'stable')
+    s, t = s[order], t[order]
+    lens = count[s]
+    ends = np.cumsum(lens)
+    cn = np.zeros(len(i), dtype = np.int64)
+    lo = 0
+    while lo < len(i):
+        base = ends[lo] - lens[lo]
+        hi = max(lo + 1, np.searchsorted(ends, base + budget, side = 'right'))
+        blens = lens[lo:hi]
+        total = blens.sum()
+        if total > 0:
+            edge = np.repeat(np.arange(hi - lo), blens)
+            pos = (np.repeat(indptr[s[lo:hi]], blens) + np.arange(total) - 
+                   np.repeat(np.cumsum(blens) - blens, blens))
+            q = np.repeat(t[lo:hi].astype(np.int64) * n, blens) + indices[pos]
+            at = np.minimum(np.searchsorted(keys, q), len(keys) - 1)
+            cn[order[lo:hi]] = np.bincount(edge[keys[at] == q], 
+                                           minlength = hi - lo)
+        lo = hi
+    return cn
+
+##  Parallel edge metrics: the CSR arrays and the edge list are saved once 
+##  to a temporary folder and memory-mapped by every worker (nothing graph 
+##  sized is pickled). Each task is a (lo, hi) slice of the edge list and 
+##  its result is written straight into a shared output array.
+_worker_adj = None
+
+def _initEdgeWorker(refs):
+    """Pool initializer -- opens the shared arrays once per worker."""
+    global _worker_adj
+    _worker_adj = dict((k, _loadShared(x)) for k, x in refs.items() 
+                       if k != 'out')
+    _worker_adj['out'] = np.load(refs['out'], mmap_mode = 'r+')
+
+def _edgeWorker(task):
+    """Pool task -- common neighbors of one slice of the edge list."""
+    lo, hi = task
+    W = _worker_adj
+    W['out'][lo:hi] = _commonNeighbors(W['indptr'], W['indices'], W['keys'],
+                                       W['i'][lo:hi], W['j'][lo:hi])
+    W['out'].flush()
+    return hi - lo
+
+def _poolCommonNeighbors(indptr, indices, keys, i, j, processes):
+    """_commonNeighbors() with the edges sharded over a process pool."""
+    processes = processes or multiprocessing.cpu_count()
+    ##  About four shards per worker, of about the same number of lookups.
+    work = np.cumsum(np.minimum(np.diff(indptr)[i], np.diff(indptr)[j]) + 1)
+    shards = 4 * processes
+    bounds = np.unique(np.r_[0, np.searchsorted(work, 
+                       np.arange(1, shards) * work[-1] / float(shards)), 
+                       len(i)]) if len(i) else np.array([0])
+    tasks = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    tmpdir = tempfile.mkdtemp(prefix = 'cdrhelper')
+    try:
+        refs = {'indptr': _shareArray(indptr, tmpdir, 'indptr'),
+                'indices': _shareArray(indices, tmpdir, 'indices'),
+                'keys': _shareArray(keys, tmpdir, 'keys'),
+                'i': _shareArray(i, tmpdir, 'i'),
+                'j': _shareArray(j, tmpdir, 'j'),
+                'out': os.path.join(tmpdir, 'out.npy')}
+        out = np.lib.format.open_memmap(refs['out'], mode = 'w+', 
+                                        dtype = np.int64, shape = (len(i),))
+        del out
+        pool = multiprocessing.Pool(processes, initializer = _initEdgeWorker,
+                                    initargs = (refs,))
+        try:
+            pool.map(_edgeWorker, tasks, chunksize = 1)
+        finally:
+            pool.terminate()
+            pool.join()
+        cn = np.array(np.load(refs['out'], mmap_mode = 'r'))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+    return cn
+
+def edgeNeighborhoods(G, nodelist = None, processes = None):
+    """Returns the edges of G, the degrees of their ends and the number of 
+    common neighbors of each edge -- what per-edge neighborhood metrics like
+    overlap() are computed from.
+    
+    Works on the CSR adjacency of G (see _adjacency()), each undirected edge
+    once. Degrees are NetworkX degrees (a self-loop counts twice).
+    
+    Parameters:
+    -----------
+    G : NetworkX graph (undirected), EdgeArrays or scipy sparse adjacency
+    nodelist : only the edges with at least one end in nodelist
+    processes : if not None, the edges are split over a pool of this many 
+        processes (0 = one per core) sharing the adjacency through memory 
+        mapped files
+    
+    Returns:
+    --------
+    edges : (number of edges, 2) array of the (u, v) node ids
+    degree_u, degree_v : degrees of the ends of each edge
+    cn : number of common neighbors of each edge
+    """
+    nodes, A = _adjacency(G)
+    i = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    j = A.indices.astype(np.intp)
+    keep = i <= j
+    i, j = i[keep], j[keep]
+    if nodelist is not None:
+        chosen = np.isin(nodes, np.asarray(list(nodelist)))
+        keep = chosen[i] | chosen[j]
+        i, j = i[keep], j[keep]
+    degree = np.diff(A.indptr) + A.diagonal()
+    keys = _adjacencyKeys(A.indptr, A.indices)
+    if processes is None:
+        cn = _commonNeighbors(A.indptr, A.indices, keys, i, j)
+    else:
+        cn = _poolCommonNeighbors(A.indptr, A.indices, keys, i, j, processes)
+    return np.column_stack((nodes[i], nodes[j])), degree[i], degree[j], cn
+
+def overlapArray(G, nodelist = None, processes = None):
+    """Returns the overlap of every edge at once, and the edges.
+    
+    Same per-edge formula as overlap(), computed from edgeNeighborhoods() 
+    with each undirected edge counted once. Undefined overlaps (both degrees
+    <= 1) are NaN.
+    
+    Parameters:
+    -----------
+    G : NetworkX graph (undirected), EdgeArrays or scipy sparse adjacency
+    nodelist : only the edges with at least one end in nodelist
+    processes : number of processes, see edgeNeighborhoods()
+    
+    Returns:
+    --------
+    olap : float array of overlap values
+    edges : (number of edges, 2) array of the (u, v) node ids of each value
+    """
+    edges, degree_i, degree_j, cn = edgeNeighborhoods(G, nodelist, processes)
+    denom = (degree_i + degree_j - cn - 2).astype(np.float64)
+    olap = np.full(len(cn), np.nan)
+    ok = ((degree_i > 1) | (degree_j > 1)) & (denom != 0)
+    olap[ok] = cn[ok] / denom[ok]
+    return olap, edges
+
+def overlapDistribution(G, nodelist = None, sort = True, engine = 'numpy',
+                        processes = None):
     """Returns a (sorted) vector of overlap values for any given set of nodes.
     
     Cycles through the entire nodelist and calculates all edges for all nodes
     in that list. Then returns a sorted list of the overlap values.
+    
+    engine : 'numpy' (default) uses overlapArray(): an array with each edge 
+        once and NaN (sorted last) for undefined overlaps. 'python' is the 
+        original edge by edge version, where edges between two nodes of 
+        nodelist show up twice and undefined overlaps are None.
+    processes : numpy engine only, number of processes to split the edges 
+        over (0 = one per core), see edgeNeighborhoods()
     """
+    if engine == 'numpy':
+        olap = overlapArray(G, nodelist, processes)[0]
+        if sort == True:
+            return np.sort(olap)
+        return olap
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
+    
     if nodelist is None:
         nodelist = G.nodes()
     olap = [overlap(G, edge) for node in nodelist for edge in G.edges(node)]
@@ -48,27 +262,428 @@ def overlapDistribution(G, nodelist = None, sort = True):
     else:
         return olap
 
-def relativeLSCCsize(D):
+def componentLabels(D, connection = 'strong'):
+    """Returns the connected component of every node and the component sizes.
+    
+    One labeling pass over the sparse adjacency of D (scipy's csgraph: 
+    Pearce's iterative version of Tarjan's algorithm for strong components).
+    Counts and largest-component fractions can all be read from the result.
+    
+    Parameters:
+    -----------
+    D : NetworkX (Di)Graph, EdgeArrays or scipy sparse adjacency
+    connection : 'strong' or 'weak'
+    
+    Returns:
+    --------
+    nodes : node ids
+    labels : component number of each node
+    sizes : number of nodes in each component
+    """
+    nodes, A = _adjacency(D, directed = True)
+    ncomp, labels = csgraph.connected_components(A, directed = True, 
+                                                 connection = connection)
+    return nodes, labels, np.bincount(labels, minlength = ncomp)
+
+def relativeLSCCsize(D, engine = 'numpy'):
     """Calculates the relative size of largest strongly connected component
     
-    Note:
-    -----
-    DEPENDS ON OLD VERSION of strongly_connected_components. See legacy.py.
+    engine : 'numpy' (default) uses componentLabels(). 'python' uses the old
+        version of strongly_connected_components, see legacy.py.
     """
+    if engine == 'numpy':
+        sizes = componentLabels(D, 'strong')[2]
+        return(sizes.max() / float(sizes.sum()))
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
     LCCsize = len(strongly_connected_components_old(D)[0])
     return(LCCsize / float(D.number_of_nodes()))
 
-def relativeLWCCsize(D):
+def relativeLWCCsize(D, engine = 'numpy'):
     """Calculates the relative size of largest weakly connected component
     
-    Note:
-    -----
-    DEPENDS ON OLD VERSION of weakly_connected_components. See legacy.py.
+    engine : 'numpy' (default) uses componentLabels(). 'python' uses the old
+        version of weakly_connected_components, see legacy.py.
     """
+    if engine == 'numpy':
+        sizes = componentLabels(D, 'weak')[2]
+        return(sizes.max() / float(sizes.sum()))
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
     LCCsize = len(weakly_connected_components_old(D)[0])
     return(LCCsize / float(D.number_of_nodes()))
 
-def summaryStats(df):
+def haversine(lat1, lon1, lat2, lon2):
+    """Returns the great-circle distance in km between two sets of points.
+    
+    Vectorized: the arguments (degrees) can be scalars or arrays of the same
+    shape. NaN where a coordinate is missing.
+    """
+    lat1, lon1, lat2, lon2 = [np.radians(np.asarray(x, dtype = np.float64))
+                              for x in (lat1, lon1, lat2, lon2)]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+def _postcodeCoords(coords):
+    """Returns (postcodes, lat, lon) of a PostcodeSampler or coords table."""
+    if isinstance(coords, PostcodeSampler):
+        return pd.Index(coords.values), coords.lat, coords.lon
+    mean = coords.groupby(np.asarray(coords['postcode'], dtype = object))[
+        ['lat', 'lon']].mean()
+    return mean.index, mean['lat'].values, mean['lon'].values
+
+def _postcodeRows(postcodes, attrpost):
+    """Returns the position in postcodes of each attribute postcode (-1 if
+    unknown).
+    
+    Files written by exportAttrData() and read back by importAttr() have 
+    numeric postcodes (e.g. 1067 for '01067'), so numeric attribute 
+    postcodes are matched against the numeric value of the keys.
+    """
+    attrpost = pd.Series(attrpost)
+    if isinstance(attrpost.dtype, pd.CategoricalDtype):
+        numeric = pd.api.types.is_numeric_dtype(attrpost.cat.categories)
+        attrpost = pd.Series(np.asarray(attrpost, dtype = object))
+        if numeric:
+            attrpost = pd.to_numeric(attrpost)
+    if pd.api.types.is_numeric_dtype(attrpost.dtype):
+        keys = pd.to_numeric(pd.Series(np.asarray(postcodes, dtype = object)),
+                             errors = 'coerce').astype(np.float64)
+        ##  Keys that only differ by leading zeros: the first one wins.
+        keys = pd.Index(keys.where(~keys.duplicated()))
+        return keys.get_indexer(attrpost.astype(np.float64).values)
+    return pd.Index(np.asarray(postcodes, dtype = object)).get_indexer(
+        np.asarray(attrpost, dtype = object))
+
+def callDistances(df_call, df_attr, coords):
+    """Returns the distance in km between the homes of A_num and B_num.
+    
+    One value per row of df_call; NaN where a postcode is missing or has no
+    coordinates. Every lookup is a vectorized index join, no loop over rows.
+    Postcodes match as strings, or by value if df_attr has numeric 
+    postcodes (as importAttr() reads them).
+    
+    Parameters:
+    -----------
+    df_call : call dataframe (A_num, B_num)
+    df_attr : attribute dataframe (A_num, postcode)
+    coords : PostcodeSampler (see postcodeSampler()) or a dataframe with 
+        postcode, lat and lon columns (e.g. postalTable())
+    """
+    postcodes, lat, lon = _postcodeCoords(coords)
+    attr = df_attr.drop_duplicates('A_num')
+    home = _postcodeRows(postcodes, attr['postcode'])
+    ##  Coordinates of every node, NaN for unknown postcodes.
+    nlat = np.where(home >= 0, np.append(lat, np.nan)[home], np.nan)
+    nlon = np.where(home >= 0, np.append(lon, np.nan)[home], np.nan)
+    nodes = pd.Index(attr['A_num'].values)
+    ends = []
+    for col in ['A_num', 'B_num']:
+        i = nodes.get_indexer(df_call[col].values)
+        ends.append((np.append(nlat, np.nan)[i], np.append(nlon, np.nan)[i]))
+    return haversine(ends[0][0], ends[0][1], ends[1][0], ends[1][1])
+
+def callDistanceDistribution(df_call, df_attr, coords, bins = 50, 
+                             weight = 'calls', log = True):
+    """Returns the histogram of distances between callers and receivers.
+    
+    Parameters:
+    -----------
+    df_call, df_attr, coords : see callDistances()
+    bins : number of bins or an array of bin edges (km)
+    weight : column of df_call to weigh the rows by (e.g. 'calls', 'min'), 
+        or None to count rows
+    log : with a number of bins, log spaced bins from 1 km (plus a first 
+        [0, 1) km bin for calls within a postcode) instead of linear ones
+    
+    Returns:
+    --------
+    counts : (weighted) number of calls in each bin
+    edges : bin edges in km
+    """
+    dist = callDistances(df_call, df_attr, coords)
+    ok = ~np.isnan(dist)
+    w = None if weight is None else df_call[weight].values[ok]
+    dist = dist[ok]
+    if np.isscalar(bins):
+        top = max(dist.max() if len(dist) else 1., 1.) * (1 + 1e-9)
+        if log:
+            bins = np.append(0., np.geomspace(1., top, bins))
+        else:
+            bins = np.linspace(0., top, bins + 1)
+    return np.histogram(dist, bins = bins, weights = w)
+
+SUMMARY_STATS = ['min', 'max', 'mean', 'median', 'var', 'std', 'nunique', 
+                 'count', 'p25', 'p75']
+
+def _numericColumns(df):
+    """Returns the numeric columns of df (bools included, as 0 and 1) and 
+    their values as a float64 matrix, NaN where missing."""
+    cols = [c for c in df.columns.values 
+            if pd.api.types.is_numeric_dtype(df[c].dtype)]
+    X = np.zeros((len(df), len(cols)))
+    for k, c in enumerate(cols):
+        X[:, k] = df[c].to_numpy(dtype = np.float64, na_value = np.nan)
+    return cols, X
+
+def _moments(X):
+    """Returns the count, mean, sum of squared deviations, min and max of 
+    every column of X, leaving out NaNs."""
+    ok = ~np.isnan(X)
+    count = ok.sum(axis = 0).astype(np.float64)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(count > 0, np.nansum(X, axis = 0) / count, 0.)
+    m2 = np.nansum((X - mean) ** 2, axis = 0)
+    lo = np.where(ok, X, np.inf).min(axis = 0, initial = np.inf)
+    hi = np.where(ok, X, -np.inf).max(axis = 0, initial = -np.inf)
+    return count, mean, m2, lo, hi
+
+def _hash64(x):
+    """Returns a 64-bit hash (splitmix64) of each float64 value of x."""
+    x = np.where(x == 0, 0., x)     # same hash for 0. and -0.
+    h = x.view(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+def _hllCount(registers):
+    """HyperLogLog estimate of the number of distinct values."""
+    m = float(len(registers))
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / \
+        np.sum(2. ** -registers.astype(np.float64))
+    zeros = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * m and zeros > 0:
+        estimate = m * np.log(m / zeros)    # small range: linear counting
+    return estimate
+
+class StatsSketch(object):
+    """Mergeable summary of the numeric columns of one or more dataframes.
+    
+    Keeps per column the count, min, max, mean and sum of squared deviations
+    (merged with Chan et al.'s formula), a HyperLogLog sketch for the number
+    of distinct values and a DDSketch (log-spaced buckets, relative error 
+    alpha) for the quantiles. As long as a column has at most 2 ** p 
+    distinct values, their exact counts are kept too, and nunique and the 
+    quantiles are exact. Sketches of different chunks or files, built in 
+    different processes if need be, merge into the sketch of all of them.
+    
+    Parameters:
+    -----------
+    p : HyperLogLog precision (2 ** p registers, about 1.04 / 2 ** (p / 2)
+        relative error on nunique)
+    alpha : relative error of the quantiles
+    """
+    
+    def __init__(self, p = 14, alpha = .01):
+        self.p = p
+        self.alpha = alpha
+        self.columns = []
+        self.count = np.zeros(0)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        self.registers = np.zeros((0, 2 ** p), dtype = np.uint8)
+        self.buckets = []       # per column: {bucket: count}, see _bucket()
+        self.exact = []         # per column: (values, counts) or None
+    
+    def _bucket(self, x):
+        """DDSketch bucket of each value: +k for positive values, -k for 
+        negative ones (k = ceil(log_gamma(|x|)), offset to stay > 0), 0 for
+        zero."""
+        gamma = (1 + self.alpha) / (1 - self.alpha)
+        with np.errstate(divide = 'ignore'):
+            k = np.ceil(np.log(np.abs(x)) / np.log(gamma))
+        k = np.where(x == 0, 0, k + 2 ** 20).astype(np.int64)
+        return np.where(x < 0, -k, k)
+    
+    def _value(self, bucket):
+        """Representative value of a bucket (see _bucket())."""
+        if bucket == 0:
+            return 0.
+        gamma = (1 + self.alpha) / (1 - self.alpha)
+        k = abs(bucket) - 2 ** 20
+        return np.sign(bucket) * 2 * gamma ** k / (gamma + 1)
+    
+    def _addColumns(self, columns):
+        """Makes room for columns not seen yet."""
+        new = [c for c in columns if c not in self.columns]
+        if not new:
+            return
+        k = len(new)
+        self.columns = self.columns + new
+        self.count = np.r_[self.count, np.zeros(k)]
+        self.mean = np.r_[self.mean, np.zeros(k)]
+        self.m2 = np.r_[self.m2, np.zeros(k)]
+        self.min = np.r_[self.min, np.full(k, np.inf)]
+        self.max = np.r_[self.max, np.full(k, -np.inf)]
+        self.registers = np.vstack((self.registers, 
+                                    np.zeros((k, 2 ** self.p), np.uint8)))
+        self.buckets = self.buckets + [{} for c in new]
+        self.exact = self.exact + [(np.zeros(0), np.zeros(0, np.int64)) 
+                                   for c in new]
+    
+    def _addExact(self, k, values, counts):
+        """Adds value counts to the exact counts of column k (dropped once 
+        there are more than 2 ** p distinct values)."""
+        if self.exact[k] is None:
+            return
+        if values is None:
+            self.exact[k] = None
+            return
+        values, inverse = np.unique(np.r_[self.exact[k][0], values], 
+                                    return_inverse = True)
+        if len(values) > 2 ** self.p:
+            self.exact[k] = None
+            return
+        self.exact[k] = (values, np.bincount(inverse, minlength = len(values),
+                         weights = np.r_[self.exact[k][1], counts])
+                         .astype(np.int64))
+    
+    def _combine(self, at, count, mean, m2, lo, hi):
+        """Merges moments (arrays for the columns at) into the sketch."""
+        n = self.count[at] + count
+        delta = mean - self.mean[at]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            share = np.where(n > 0, count / n, 0.)
+        self.m2[at] += m2 + delta ** 2 * self.count[at] * share
+        self.mean[at] += delta * share
+        self.count[at] = n
+        self.min[at] = np.fmin(self.min[at], lo)
+        self.max[at] = np.fmax(self.max[at], hi)
+    
+    def update(self, df):
+        """Adds the numeric columns of a dataframe (e.g. one chunk)."""
+        cols, X = _numericColumns(df)
+        self._addColumns(cols)
+        at = np.array([self.columns.index(c) for c in cols], dtype = np.intp)
+        if len(cols) == 0 or len(df) == 0:
+            return self
+        ok = ~np.isnan(X)
+        self._combine(at, *_moments(X))
+        
+        shift = np.uint64(64 - self.p)
+        for c, k in enumerate(at):
+            x = X[ok[:, c], c]
+            if len(x) == 0:
+                continue
+            ##  HyperLogLog: register = top p bits, rank = position of the
+            ##  first 1 bit in the rest.
+            h = _hash64(x)
+            reg = (h >> shift).astype(np.intp)
+            rest = (h & ((np.uint64(1) << shift) - np.uint64(1)))
+            rank = np.where(rest == 0, 64 - self.p + 1, 64 - self.p - 
+                            np.floor(np.log2(np.maximum(rest, 1)
+                                             .astype(np.float64)))
+                            ).astype(np.uint8)
+            np.maximum.at(self.registers[k], reg, rank)
+            if self.exact[k] is not None:
+                self._addExact(k, *np.unique(x, return_counts = True))
+            ##  DDSketch buckets.
+            keys, counts = np.unique(self._bucket(x), return_counts = True)
+            b = self.buckets[k]
+            for key, n in zip(keys.tolist(), counts.tolist()):
+                b[key] = b.get(key, 0) + n
+        return self
+    
+    def merge(self, other):
+        """Adds another StatsSketch (same p and alpha) to this one."""
+        if (other.p != self.p) or (other.alpha != self.alpha):
+            raise ValueError("Sketches with different p or alpha.")
+        self._addColumns(other.columns)
+        at = np.array([self.columns.index(c) for c in other.columns], 
+                      dtype = np.intp)
+        if len(at) == 0:
+            return self
+        self._combine(at, other.count, other.mean, other.m2, other.min, 
+                      other.max)
+        self.registers[at] = np.maximum(self.registers[at], other.registers)
+        for k, b, exact in zip(at, other.buckets, other.exact):
+            mine = self.buckets[k]
+            for key, n in b.items():
+                mine[key] = mine.get(key, 0) + n
+            if exact is None:
+                self._addExact(k, None, None)
+            else:
+                self._addExact(k, *exact)
+        return self
+    
+    def quantile(self, col, q):
+        """Approximate q quantile of a column (within alpha, relative)."""
+        k = self.columns.index(col)
+        n = self.count[k]
+        if n == 0:
+            return np.nan
+        rank = q * (n - 1)
+        if self.exact[k] is not None:
+            ##  Exact, interpolated like pandas' quantile().
+            values, counts = self.exact[k]
+            ends = np.cumsum(counts)
+            lo, hi = values[np.searchsorted(ends, [np.floor(rank), 
+                                                   np.ceil(rank)], 
+                                            side = 'right')]
+            return lo + (hi - lo) * (rank - np.floor(rank))
+        seen = 0
+        for key in sorted(self.buckets[k]):
+            seen += self.buckets[k][key]
+            if seen > rank:
+                break
+        return min(max(self._value(key), self.min[k]), self.max[k])
+    
+    def _nunique(self, k):
+        """Number of distinct values of column k (exact or HyperLogLog)."""
+        if self.exact[k] is not None:
+            return len(self.exact[k][0])
+        return np.round(_hllCount(self.registers[k]))
+    
+    def table(self):
+        """Returns the summaryStats() table of everything added so far."""
+        holder = pd.DataFrame(index = SUMMARY_STATS)
+        for k, col in enumerate(self.columns):
+            n = self.count[k]
+            var = self.m2[k] / (n - 1) if n > 1 else np.nan
+            empty = n == 0
+            holder[col] = [np.nan if empty else self.min[k], 
+                           np.nan if empty else self.max[k],
+                           np.nan if empty else self.mean[k],
+                           self.quantile(col, .5), var, np.sqrt(var),
+                           self._nunique(k), n,
+                           self.quantile(col, .25), self.quantile(col, .75)]
+        return(holder)
+
+def _exactStats(df):
+    """The exact summaryStats() table of one dataframe: the moments of all 
+    its numeric columns in one pass, then the median, quartiles and number 
+    of distinct values from one sort of each column."""
+    cols, X = _numericColumns(df)
+    count, mean, m2, lo, hi = _moments(X)
+    empty = count == 0
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        var = np.where(count > 1, m2 / (count - 1), np.nan)
+    ##  NaNs sort last, so the first count values of a row are its values.
+    S = np.sort(X.T, axis = 1) if len(X) else np.full((len(cols), 1), np.nan)
+    n = count.astype(np.intp)
+    rows = np.arange(len(cols))
+    def quantile(q):
+        ##  Linear interpolation, like pandas' quantile().
+        rank = q * np.maximum(n - 1, 0)
+        below = np.floor(rank).astype(np.intp)
+        above = np.ceil(rank).astype(np.intp)
+        return np.where(empty, np.nan, S[rows, below] + 
+                        (S[rows, above] - S[rows, below]) * (rank - below))
+    nunique = (((S[:, 1:] != S[:, :-1]) & 
+                (np.arange(1, S.shape[1]) < n[:, None])).sum(axis = 1) + 
+               (n > 0))
+    holder = pd.DataFrame([np.where(empty, np.nan, lo), 
+                           np.where(empty, np.nan, hi),
+                           np.where(empty, np.nan, mean), quantile(.5), var,
+                           np.sqrt(var), nunique, count, 
+                           quantile(.25), quantile(.75)],
+                          index = SUMMARY_STATS, columns = cols)
+    return(holder.astype(np.float64))
+
+def summaryStats(df, engine = 'numpy'):
     """Produces a very crude summary table from an attribute dataframe.
     
     This is a very 'R' way of producing a quick and dirty summary table. Use 
@@ -78,38 +693,49 @@ def summaryStats(df):
     Parameters:
     -----------
     df : pandas dataframe you want analyzed. It makes the most sense for 
-    the attribute dataframe, but is generalized enough for any df.
+    the attribute dataframe, but is generalized enough for any df. With the
+    numpy engine, df can also be an iterable of dataframes (e.g. 
+    pd.read_csv(..., chunksize = 1000000)) or a StatsSketch.
+    engine : 'numpy' (default). A single dataframe is summarized exactly: 
+        one vectorized pass for the moments of all numeric columns at once
+        and one sort per column for the median, quartiles and nunique.
+        Chunks are summarized in one pass each with a StatsSketch: exact 
+        min, max, mean, var, std and count; median, quartiles and nunique 
+        are approximate (about 1%). 'python' is the original column-by-column
+        version (exact, single dataframe only).
     """
-    summary_stats = ['min', 'max', 'mean', 'median', 'var', 'std', 'nunique', 
-                    'count', 'p25', 'p75']
+    if engine == 'numpy':
+        if isinstance(df, pd.DataFrame):
+            return _exactStats(df)
+        if isinstance(df, StatsSketch):
+            return df.table()
+        sketch = StatsSketch()
+        for chunk in df:
+            sketch.update(chunk)
+        return sketch.table()
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
+    
+    summary_stats = SUMMARY_STATS
     holder = pd.DataFrame(index = summary_stats)
     for col in df.columns.values:
-        if df[col].dtype != np.object:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            ##  Bools as 0 and 1, like the numpy engine.
+            x = df[col].astype(np.float64) \
+                if pd.api.types.is_bool_dtype(df[col]) else df[col]
             stat_vector = np.zeros(10)
             i = 0
             for stat in summary_stats[:8]:
-                attr = df[col].__getattribute__(stat)
+                attr = x.__getattribute__(stat)
                 stat_vector[i] = attr()
                 i += 1
-            stat_vector[8] = df[col].quantile(.25)
-            stat_vector[9] = df[col].quantile(.75)
+            stat_vector[8] = x.quantile(.25)
+            stat_vector[9] = x.quantile(.75)
             holder[col] = stat_vector
     return(holder)
 
-def DNetworkSummary(D, qtr, filename = None):
-    """Just outputs and prints a quick table of DIRECTED network statistics."""
-    ##  Calculate all the network summary stats
-    n = D.number_of_nodes()
-    e = D.size()
-    e_c = D.size(weight = 'calls')
-    e_min = D.size(weight = 'min')
-    e_sms = D.size(weight = 'sms')
-    e_mms = D.size(weight = 'mms')
-    n_scc = nx.number_strongly_connected_components(D)
-    r_scc = relativeLSCCsize(D)
-    n_wcc = nx.number_weakly_connected_components(D)
-    r_wcc = relativeLWCCsize(D)
-    
+def _DSummaryTable(result, filename = None):
+    """Prints (and saves) the DNetworkSummary() table of result."""
     ##  Description vector for printout and output file
     ts  = "    "  # just so the output file is a little more readable
     a1  = "Directed Network Statistics -- Quarter "
@@ -124,27 +750,141 @@ def DNetworkSummary(D, qtr, filename = None):
     a10 = ts + "Number of Weakly Connected Components (WCC): "
     a11 = ts + ts + "Relative size of largest WCC: "
     name = [a1, a2, a3, a4, a5, a6, a7, a8, a9, a10, a11]
-    result = [qtr, n, e, e_c, e_min, e_sms, e_mms, n_scc, r_scc, n_wcc, r_wcc]
     outputresults = pd.DataFrame(data = {'Description': name, 'Result': result})
     if (filename is not None):
         outputresults.to_csv(filename, index = False)
-    print outputresults
+    print(outputresults)
 
-def GNetworkSummary(G, qtr, filename = None):
-    """Just outputs and prints a quick table of clustering statistics."""
+def DNetworkSummary(D, qtr, filename = None):
+    """Just outputs and prints a quick table of DIRECTED network statistics."""
     ##  Calculate all the network summary stats
-    n = G.number_of_nodes()
-    e = G.size()
-    e_c = G.size(weight = 'calls')
-    e_min = G.size(weight = 'min')
-    e_sms = G.size(weight = 'sms')
-    e_mms = G.size(weight = 'mms')
-    avgC = nx.average_clustering(G)
-    avgC_c = nx.average_clustering(G, weight = 'calls')
-    avgC_min = nx.average_clustering(G, weight = 'min')
-    avgC_sms = nx.average_clustering(G, weight = 'sms')
-    avgC_mms = nx.average_clustering(G, weight = 'mms')
+    n = D.number_of_nodes()
+    e = D.size()
+    e_c = D.size(weight = 'calls')
+    e_min = D.size(weight = 'min')
+    e_sms = D.size(weight = 'sms')
+    e_mms = D.size(weight = 'mms')
+    ##  One labeling pass per kind of component for both count and fraction.
+    scc = componentLabels(D, 'strong')[2]
+    wcc = componentLabels(D, 'weak')[2]
+    n_scc = len(scc)
+    r_scc = scc.max() / float(n)
+    n_wcc = len(wcc)
+    r_wcc = wcc.max() / float(n)
+    
+    result = [qtr, n, e, e_c, e_min, e_sms, e_mms, n_scc, r_scc, n_wcc, r_wcc]
+    _DSummaryTable(result, filename)
+
+def _weightedEdges(G, weights):
+    """Returns the node ids, the (u, v) index arrays and the weight arrays
+    of the edges of G (NetworkX graph or EdgeArrays). Missing weights are 1,
+    as in NetworkX."""
+    if isinstance(G, EdgeArrays):
+        return (G.nodes, G.row, G.col, 
+                [np.asarray(getattr(G, w), dtype = np.float64) 
+                 for w in weights])
+    nodes = list(G)
+    index = dict(zip(nodes, range(len(nodes))))
+    u, v = [], []
+    W = [[] for w in weights]
+    for a, b, d in G.edges(data = True):
+        u.append(index[a])
+        v.append(index[b])
+        for x, w in zip(W, weights):
+            x.append(d.get(w, 1))
+    return (np.asarray(nodes), np.asarray(u, dtype = np.int64), 
+            np.asarray(v, dtype = np.int64), 
+            [np.asarray(x, dtype = np.float64) for x in W])
+
+def _triangles(indptr, indices, budget = 2 ** 24):
+    """Yields every triangle of an oriented CSR adjacency once.
+    
+    Each edge (i, j) is oriented from lower to higher degree rank, so a 
+    triangle i < j < k (in rank) is found once, from its (i, j) edge: the 
+    out-neighbors k of j are looked up as (i, k). Yields the positions of 
+    the (i, j), (j, k) and (i, k) entries in indices, in batches of about 
+    budget lookups.
+    """
+    n = len(indptr) - 1
+    count = np.diff(indptr)
+    a = np.repeat(np.arange(n, dtype = np.int64), count)
+    keys = a * n + indices
+    lens = count[indices]
+    ends = np.cumsum(lens)
+    lo = 0
+    while lo < len(indices):
+        base = ends[lo] - lens[lo]
+        hi = max(lo + 1, np.searchsorted(ends, base + budget, side = 'right'))
+        blens = lens[lo:hi]
+        total = blens.sum()
+        if total > 0:
+            ij = np.repeat(np.arange(lo, hi), blens)
+            jk = (np.repeat(indptr[indices[lo:hi]], blens) + np.arange(total) -
+                  np.repeat(np.cumsum(blens) - blens, blens))
+            q = a[ij] * n + indices[jk]
+            ik = np.minimum(np.searchsorted(keys, q), len(keys) - 1)
+            hit = keys[ik] == q
+            yield ij[hit], jk[hit], ik[hit]
+        lo = hi
+
+def clusteringArrays(G, weights = ['calls', 'min', 'sms', 'mms']):
+    """Returns the clustering coefficient of every node, unweighted and 
+    weighted by each of weights, from a single pass over the triangles.
+    
+    Same values as nx.clustering(G) and nx.clustering(G, weight = w): the 
+    weighted version uses the geometric mean of the triangle's edge weights
+    normalized by the largest weight.
+    
+    Parameters:
+    -----------
+    G : NetworkX graph (undirected) or undirected EdgeArrays
+    weights : edge weights to compute weighted clustering for
+    
+    Returns:
+    --------
+    nodes : node ids
+    clustering : dict of clustering arrays (same order as nodes), None for 
+        the unweighted one and each weight name for the weighted ones
+    """
+    nodes, u, v, W = _weightedEdges(G, weights)
+    n = len(nodes)
+    W = [x / x.max() if len(x) and x.max() != 0 else x for x in W]
+    ##  Self-loops count for the largest weight only.
+    loop = u == v
+    u, v, W = u[~loop], v[~loop], [x[~loop] for x in W]
+    degree = np.bincount(u, minlength = n) + np.bincount(v, minlength = n)
+    
+    ##  Orient the edges by (degree, index) rank and sort them into a CSR.
+    rank = np.empty(n, dtype = np.int64)
+    rank[np.lexsort((np.arange(n), degree))] = np.arange(n)
+    up = rank[u] < rank[v]
+    a, b = np.where(up, rank[u], rank[v]), np.where(up, rank[v], rank[u])
+    order = np.lexsort((b, a))
+    a, b, W = a[order], b[order], [x[order] for x in W]
+    indptr = np.r_[0, np.cumsum(np.bincount(a, minlength = n))]
+    
+    totals = [np.zeros(n) for x in range(len(W) + 1)]
+    for ij, jk, ik in _triangles(indptr, b):
+        corners = np.concatenate((a[ij], b[ij], b[jk]))
+        totals[0] += np.bincount(corners, minlength = n)
+        for total, x in zip(totals[1:], W):
+            t = np.cbrt(x[ij] * x[jk] * x[ik])
+            total += np.bincount(corners, weights = np.tile(t, 3), 
+                                 minlength = n)
     
+    ##  Back from rank to node order; each triangle counts for two ordered 
+    ##  pairs of neighbors.
+    pairs = (degree * (degree - 1)).astype(np.float64)
+    clustering = {}
+    for name, total in zip([None] + list(weights), totals):
+        c = np.zeros(n)
+        ok = pairs > 0
+        c[ok] = 2 * total[rank][ok] / pairs[ok]
+        clustering[name] = c
+    return nodes, clustering
+
+def _GSummaryTable(result, filename = None):
+    """Prints (and saves) the GNetworkSummary() table of result."""
     ##  Description vector for printout and output file
     ts  = "    "  # just so the output file is a little more readable
     a1  = "Undirected Network Statistics -- Quarter "
@@ -160,9 +900,332 @@ def GNetworkSummary(G, qtr, filename = None):
     a15 = ts + ts + "Avgerage Clustering (weighted by SMS): "
     a16 = ts + ts + "Avgerage Clustering (weighted by MMS): "
     name = [a1, a2, a3, a4, a5, a6, a7, a12, a13, a14, a15, a16]
-    result = [qtr, n, e, e_c, e_min, e_sms, e_mms,
-              avgC, avgC_c, avgC_min, avgC_sms, avgC_mms]
     outputresults = pd.DataFrame(data = {'Description': name, 'Result': result})
     if (filename is not None):
         outputresults.to_csv(filename, index = False)
-    print outputresults
+    print(outputresults)
+
+def GNetworkSummary(G, qtr, filename = None):
+    """Just outputs and prints a quick table of clustering statistics."""
+    ##  Calculate all the network summary stats
+    n = G.number_of_nodes()
+    e = G.size()
+    e_c = G.size(weight = 'calls')
+    e_min = G.size(weight = 'min')
+    e_sms = G.size(weight = 'sms')
+    e_mms = G.size(weight = 'mms')
+    ##  All five clusterings from one pass over the triangles.
+    C = clusteringArrays(G, ['calls', 'min', 'sms', 'mms'])[1]
+    avgC = C[None].mean()
+    avgC_c = C['calls'].mean()
+    avgC_min = C['min'].mean()
+    avgC_sms = C['sms'].mean()
+    avgC_mms = C['mms'].mean()
+    
+    result = [qtr, n, e, e_c, e_min, e_sms, e_mms,
+              avgC, avgC_c, avgC_min, avgC_sms, avgC_mms]
+    _GSummaryTable(result, filename)
+
+##  Incremental network summary: nodes, edges and adjacency are kept in 
+##  sorted int64 key arrays (node index pairs packed as i << 32 | j) that
+##  each batch is merged into with searchsorted.
+def _pairKeys(i, j):
+    """Packs node index pairs into sortable int64 keys."""
+    return ((np.asarray(i, dtype = np.int64) << 32) | 
+            np.asarray(j, dtype = np.int64))
+
+def _lookup(keys, q):
+    """Returns the positions of q in the sorted keys and whether they are 
+    there."""
+    if len(keys) == 0:
+        return (np.zeros(len(q), dtype = np.int64), 
+                np.zeros(len(q), dtype = bool))
+    pos = np.minimum(np.searchsorted(keys, q), len(keys) - 1)
+    return pos, keys[pos] == q
+
+def _mergeKeys(keys, values, new, newvalues):
+    """Inserts the (unique, absent) keys new and their values (rows) into 
+    the sorted keys and values."""
+    order = np.argsort(new, kind = 'stable')
+    at = np.searchsorted(keys, new[order])
+    return (np.insert(keys, at, new[order]), 
+            np.insert(values, at, newvalues[order], axis = 0))
+
+def _slices(start, stop, budget = 2 ** 24):
+    """Yields (rows, positions) expanding the ranges start[r]:stop[r], in 
+    batches of about budget positions."""
+    lens = stop - start
+    ends = np.cumsum(lens)
+    lo = 0
+    while lo < len(lens):
+        hi = max(lo + 1, np.searchsorted(ends, ends[lo] - lens[lo] + budget,
+                                         side = 'right'))
+        blens = lens[lo:hi]
+        rows = np.repeat(np.arange(lo, hi), blens)
+        yield rows, (np.repeat(start[lo:hi] - (np.cumsum(blens) - blens), 
+                               blens) + np.arange(blens.sum()))
+        lo = hi
+
+class NetworkSummary(object):
+    """Network summary statistics kept up to date as call records come in.
+    
+    Each batch of calls (e.g. one new day) is summed per edge and merged 
+    into sorted edge arrays. Weak components are kept in a union-find, and
+    the triangle counts and weighted triangle sums (cbrt(w_ij w_jk w_ik),
+    before normalizing by the largest weight) of every node are updated 
+    from the triangles through the new edges and the edges whose weights 
+    changed only, so an update costs about the size of the batch and its 
+    neighborhood, not of the network. DSummary() and GSummary() print the 
+    same tables as DNetworkSummary() and GNetworkSummary() on the graphs 
+    importEdges() would build. Strong components depend on the whole 
+    network; they are computed (one pass) when that table is asked for.
+    
+    Example:
+    --------
+    S = NetworkSummary(importNodeAttr(afile).nodes)
+    for cfile in dailyfiles:
+        S.update(cfile)
+    S.DSummary(qtr = 1)
+    """
+    
+    def __init__(self, nodes = None):
+        """nodes : node ids to include even before they make any call"""
+        k = len(WEIGHTS)
+        self._ids = np.zeros(0, dtype = np.int64)       # node id by index
+        self._idkeys = np.zeros(0, dtype = np.int64)    # sorted node ids
+        self._idindex = np.zeros(0, dtype = np.int64)   # and their indices
+        self._parent = np.zeros(0, dtype = np.int64)    # union-find forest 
+        self._size = np.zeros(0, dtype = np.int64)      # of weak components
+        self.n_wcc = 0
+        self.largest_wcc = 0
+        self._degree = np.zeros(0, dtype = np.int64)    # no self-loops
+        self._triangles = np.zeros(0, dtype = np.int64)
+        self._wtriangles = np.zeros((0, k))
+        ##  Directed edges: sorted keys and their weights.
+        self._dkeys = np.zeros(0, dtype = np.int64)
+        self._dweights = np.zeros((0, k))
+        ##  Undirected edges (min, max): ends and weights by edge id, sorted
+        ##  keys with their edge ids, and the adjacency (both directions, no
+        ##  self-loops) as sorted keys with their edge ids.
+        self._ends = np.zeros((0, 2), dtype = np.int64)
+        self._uweights = np.zeros((0, k))
+        self._ukeys = np.zeros(0, dtype = np.int64)
+        self._uedge = np.zeros(0, dtype = np.int64)
+        self._akeys = np.zeros(0, dtype = np.int64)
+        self._aedge = np.zeros(0, dtype = np.int64)
+        self.totals = np.zeros(k)
+        if nodes is not None:
+            self.addNodes(nodes)
+    
+    def addNodes(self, nodes):
+        """Adds nodes (ids) without any edge."""
+        self._nodeIndex(np.fromiter(nodes, dtype = np.int64))
+    
+    def _nodeIndex(self, ids):
+        """Returns the indices of node ids, adding the new ones."""
+        ids, inverse = np.unique(ids, return_inverse = True)
+        pos, hit = _lookup(self._idkeys, ids)
+        if hit.all():
+            return self._idindex[pos][inverse]
+        new = ids[~hit]
+        n = len(self._ids)
+        index = np.arange(n, n + len(new))
+        self._idkeys, self._idindex = _mergeKeys(self._idkeys, self._idindex,
+                                                 new, index)
+        self._ids = np.concatenate((self._ids, new))
+        self._parent = np.concatenate((self._parent, index))
+        self._size = np.concatenate((self._size, np.ones_like(index)))
+        self._degree = np.concatenate((self._degree, np.zeros_like(index)))
+        self._triangles = np.concatenate((self._triangles, 
+                                          np.zeros_like(index)))
+        self._wtriangles = np.concatenate((self._wtriangles, 
+                                           np.zeros((len(new), 
+                                                     len(WEIGHTS)))))
+        self.n_wcc += len(new)
+        self.largest_wcc = max(self.largest_wcc, 1)
+        return self._idindex[_lookup(self._idkeys, ids)[0]][inverse]
+    
+    def _roots(self, i):
+        """Union-find roots of the indices i (with path halving)."""
+        parent = self._parent
+        while True:
+            p = parent[i]
+            if (p == i).all():
+                return i
+            parent[i] = parent[p]
+            i = parent[i]
+    
+    def _union(self, u, v):
+        """Merges the weak components linked by the edges (u, v)."""
+        ru, rv = self._roots(u), self._roots(v)
+        link = ru != rv
+        if not link.any():
+            return
+        roots, pair = np.unique(np.concatenate((ru[link], rv[link])), 
+                                return_inverse = True)
+        pair = pair.reshape(2, -1)
+        m = sp.coo_matrix((np.ones(pair.shape[1]), (pair[0], pair[1])), 
+                          shape = (len(roots), len(roots)))
+        ncomp, label = csgraph.connected_components(m, directed = False)
+        ##  The largest root of each merged component takes in the others.
+        order = np.lexsort((self._size[roots], label))
+        top = roots[order][np.r_[label[order][1:] != label[order][:-1], 
+                                 True]]
+        size = np.bincount(label, weights = self._size[roots])
+        self._parent[roots] = top[label]
+        self._size[top] = size
+        self.n_wcc -= len(roots) - ncomp
+        self.largest_wcc = max(self.largest_wcc, int(size.max()))
+    
+    def _newEdges(self, u, v, ids):
+        """Adds the undirected edges (u, v) (u <= v) with edge ids ids to 
+        the components, degrees and adjacency."""
+        self._union(u, v)
+        loop = u == v
+        u, v, ids = u[~loop], v[~loop], ids[~loop]
+        self._degree += (np.bincount(u, minlength = len(self._ids)) + 
+                         np.bincount(v, minlength = len(self._ids)))
+        self._akeys, self._aedge = _mergeKeys(
+            self._akeys, self._aedge, np.concatenate((_pairKeys(u, v), 
+                                                      _pairKeys(v, u))),
+            np.concatenate((ids, ids)))
+    
+    def _touchedTriangles(self, touched):
+        """Yields the triangles through the touched (sorted) edge ids as 
+        (e, f, g, k) arrays: the touched edge e = (i, j), the edges f and g
+        joining its ends to the third corner k. Each triangle comes once,
+        from its lowest touched edge."""
+        ends = self._ends[touched]
+        loop = ends[:, 0] == ends[:, 1]
+        touched, ends = touched[~loop], ends[~loop]
+        ##  Scan the neighbors of the end with the lower degree.
+        low = self._degree[ends[:, 0]] <= self._degree[ends[:, 1]]
+        s = np.where(low, ends[:, 0], ends[:, 1])
+        o = np.where(low, ends[:, 1], ends[:, 0])
+        start = np.searchsorted(self._akeys, _pairKeys(s, 0))
+        stop = np.searchsorted(self._akeys, _pairKeys(s + 1, 0))
+        mark = np.zeros(len(self._ends), dtype = bool)
+        mark[touched] = True
+        for rows, pos in _slices(start, stop):
+            k = self._akeys[pos] & 0xffffffff
+            at, hit = _lookup(self._akeys, _pairKeys(o[rows], k))
+            e, f, g = touched[rows][hit], self._aedge[pos][hit], \
+                      self._aedge[at[hit]]
+            keep = (~mark[f] | (f > e)) & (~mark[g] | (g > e))
+            yield e[keep], f[keep], g[keep], k[hit][keep]
+    
+    def update(self, calls):
+        """Adds a batch of call records.
+        
+        Parameters:
+        -----------
+        calls : a call dataframe (see importCalls()) or a raw call file
+        """
+        if not isinstance(calls, pd.DataFrame):
+            calls = importCalls(calls)
+        calls = calls.dropna(subset = ['A_num', 'B_num'])
+        w = calls[WEIGHTS].fillna(0).values.astype(np.float64)
+        self.totals += w.sum(axis = 0)
+        i, j = self._nodeIndex(np.concatenate((
+            np.asarray(calls['A_num'], dtype = np.int64),
+            np.asarray(calls['B_num'], dtype = np.int64)))).reshape(2, -1)
+        
+        ##  Directed edges: add to the existing ones, insert the others.
+        a, b, x = _reduceEdges(i, j, w, True)
+        keys = _pairKeys(a, b)
+        at, hit = _lookup(self._dkeys, keys)
+        self._dweights[at[hit]] += x[hit]
+        self._dkeys, self._dweights = _mergeKeys(self._dkeys, self._dweights,
+                                                 keys[~hit], x[~hit])
+        
+        ##  Undirected edges: keep the old weights of the changed ones for 
+        ##  the triangle update, then add the new ones with the next ids.
+        a, b, x = _reduceEdges(i, j, w, False)
+        keys = _pairKeys(a, b)
+        at, hit = _lookup(self._ukeys, keys)
+        changed = self._uedge[at[hit]]
+        order = np.argsort(changed)
+        changed = changed[order]
+        old = self._uweights[changed].copy()
+        self._uweights[changed] += x[hit][order]
+        nold = len(self._ends)
+        new = np.arange(nold, nold + (~hit).sum())
+        self._ends = np.concatenate((self._ends, 
+                                     np.column_stack((a[~hit], b[~hit]))))
+        self._uweights = np.concatenate((self._uweights, x[~hit]))
+        self._ukeys, self._uedge = _mergeKeys(self._ukeys, self._uedge, 
+                                              keys[~hit], new)
+        self._newEdges(a[~hit], b[~hit], new)
+        
+        ##  Triangles through the new and changed edges: a triangle with a 
+        ##  new edge is new (counted, full weight); otherwise its weighted 
+        ##  sum changes from the old weights to the new ones.
+        def before(e):
+            at, hit = _lookup(changed, e)
+            return np.where(hit[:, None], old[at], self._uweights[e])
+        n = len(self._ids)
+        W = self._uweights
+        for e, f, g, k in self._touchedTriangles(np.concatenate((changed, 
+                                                                 new))):
+            corners = np.concatenate((self._ends[e, 0], self._ends[e, 1], k))
+            isnew = np.tile((e >= nold) | (f >= nold) | (g >= nold), 3)
+            self._triangles += np.bincount(corners[isnew], minlength = n)
+            t = np.cbrt(W[e] * W[f] * W[g])
+            prior = (e < nold) & (f < nold) & (g < nold)
+            t[prior] -= np.cbrt(before(e[prior]) * before(f[prior]) * 
+                                before(g[prior]))
+            t = np.tile(t, (3, 1))
+            for c in range(len(WEIGHTS)):
+                self._wtriangles[:, c] += np.bincount(corners, 
+                                                      weights = t[:, c],
+                                                      minlength = n)
+    
+    def _edgeArrays(self, directed):
+        """Returns the current edges as EdgeArrays."""
+        if directed:
+            u, v = self._dkeys >> 32, self._dkeys & 0xffffffff
+            w = self._dweights
+        else:
+            u, v, w = self._ends[:, 0], self._ends[:, 1], self._uweights
+        return EdgeArrays(self._ids, u, v, 
+                          *([w[:, k] for k in range(len(WEIGHTS))] + 
+                            [directed]))
+    
+    def clustering(self, weight = None):
+        """Returns the clustering of every node (node order of nodes()), 
+        unweighted or weighted by one of WEIGHTS (as nx.clustering()), from
+        the triangle counts and sums."""
+        d = self._degree.astype(np.float64)
+        if weight is None:
+            t = self._triangles.astype(np.float64)
+        else:
+            ##  cbrt of the product of normalized weights = cbrt / largest.
+            t = self._wtriangles[:, WEIGHTS.index(weight)]
+            top = self._uweights[:, WEIGHTS.index(weight)].max() \
+                if len(self._uweights) else 0
+            if top != 0:
+                t = t / top
+        c = np.zeros(len(d))
+        ok = d > 1
+        c[ok] = 2 * t[ok] / (d[ok] * (d[ok] - 1))
+        return c
+    
+    def nodes(self):
+        """Returns the node ids."""
+        return self._ids.copy()
+    
+    def DSummary(self, qtr, filename = None):
+        """Prints the DNetworkSummary() table of the calls so far."""
+        n = len(self._ids)
+        scc = componentLabels(self._edgeArrays(True), 'strong')[2]
+        result = [qtr, n, len(self._dkeys)] + self.totals.tolist() + \
+                 [len(scc), scc.max() / float(n), 
+                  self.n_wcc, self.largest_wcc / float(n)]
+        _DSummaryTable(result, filename)
+    
+    def GSummary(self, qtr, filename = None):
+        """Prints the GNetworkSummary() table of the calls so far."""
+        result = [qtr, len(self._ids), len(self._ukeys)] + \
+                 self.totals.tolist() + [self.clustering().mean()] + \
+                 [self.clustering(w).mean() for w in WEIGHTS]
+        _GSummaryTable(result, filename)
@@ -0,0 +1,161 @@
+"""
+Columnar binary cache for the raw call and attribute files.
+
+The first import of a raw file parses it as usual and saves every column as
+its own .npy file (plus a small JSON file of metadata) in the cache folder.
+Later imports of the same file memory-map those columns instead of parsing
+the text again. Entries are keyed by the path of the raw file and checked
+against its size and modification time, so they are rebuilt automatically
+when the file changes. The folder is kept under CACHE_SIZE bytes by dropping
+the least recently used entries.
+
+cachedFrame() - returns a (memory-mapped) dataframe of a raw file's columns
+clearCache() - empties the cache folder
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cdrhelper', 'cache')
+CACHE_SIZE = 10 * 2 ** 30   # bytes
+
+def _cacheFolder(cachedir):
+    """Returns the cache folder (cachedir = True or None means CACHE_DIR)."""
+    if cachedir is None or cachedir is True:
+        return CACHE_DIR
+    return cachedir
+
+def _entryPath(path, kind, cachedir):
+    """Returns the cache entry folder of a raw file."""
+    key = os.path.abspath(path) + '|' + kind
+    return os.path.join(cachedir, hashlib.sha1(key.encode('utf-8'))
+                                         .hexdigest())
+
+def _fileStamp(path):
+    """Returns what has to match for a cache entry to be used."""
+    st = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': st.st_size,
+            'mtime': repr(st.st_mtime)}
+
+def _entrySize(entry):
+    """Returns the size of a cache entry in bytes."""
+    return sum(os.path.getsize(os.path.join(entry, f))
+               for f in os.listdir(entry))
+
+def _writeColumns(df, entry, stamp):
+    """Saves the columns of df as .npy files in the entry folder.
+
+    Numeric columns are saved as is. Categorical and string (object) columns
+    are saved as integer codes with the categories in the metadata. The
+    folder is written next to the entry and then moved in place so readers
+    never see half an entry.
+    """
+    tmp = tempfile.mkdtemp(dir = os.path.dirname(entry))
+    columns = []
+    for i, col in enumerate(df.columns):
+        x = df[col]
+        info = {'name': col, 'file': 'c%d.npy' % i}
+        if isinstance(x.dtype, pd.CategoricalDtype):
+            info['kind'] = 'category'
+            info['categories'] = x.cat.categories.tolist()
+            info['ordered'] = bool(x.cat.ordered)
+            values = x.cat.codes.values
+        elif isinstance(x.dtype, np.dtype) and x.dtype != object:
+            info['kind'] = 'numeric'
+            values = x.values
+        else:   # strings
+            codes, uniques = pd.factorize(x)
+            info['kind'] = 'object'
+            info['categories'] = list(uniques)
+            values = codes.astype(np.int32)
+        np.save(os.path.join(tmp, info['file']), values)
+        columns.append(info)
+    meta = {'stamp': stamp, 'columns': columns,
+            'index': df.index.name if df.index.name in df.columns else None}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(entry):
+        shutil.rmtree(entry, ignore_errors = True)
+    os.rename(tmp, entry)
+
+def _readColumns(entry, meta):
+    """Returns a dataframe of memory-mapped columns from a cache entry.
+    
+    The maps are copy-on-write: the frame can be edited like a parsed one,
+    edited pages are copied in memory and the entry itself never changes.
+    """
+    data = {}
+    for info in meta['columns']:
+        values = np.load(os.path.join(entry, info['file']), mmap_mode = 'c')
+        if info['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, info['categories'],
+                                               ordered = info['ordered'])
+        elif info['kind'] == 'object':
+            values = np.asarray(info['categories'] + [np.nan],
+                                dtype = object)[values]
+        data[info['name']] = values
+    df = pd.DataFrame(data, columns = [x['name'] for x in meta['columns']],
+                      copy = False)
+    if meta['index'] is not None:
+        df.index = df[meta['index']]
+    return df
+
+def _evict(cachedir, maxbytes, keep):
+    """Drops least recently used entries until cachedir fits in maxbytes."""
+    entries = []
+    for name in os.listdir(cachedir):
+        entry = os.path.join(cachedir, name)
+        meta = os.path.join(entry, 'meta.json')
+        if entry != keep and os.path.isfile(meta):
+            entries.append((os.path.getmtime(meta), _entrySize(entry), entry))
+    total = sum(x[1] for x in entries) + _entrySize(keep)
+    for used, size, entry in sorted(entries):
+        if total <= maxbytes:
+            break
+        shutil.rmtree(entry, ignore_errors = True)
+        total -= size
+
+def cachedFrame(path, kind, reader, cachedir = None, maxbytes = None):
+    """Returns the columns of a raw file as a dataframe, via the cache.
+
+    If the cache has an up to date entry for path, its columns are
+    memory-mapped (milliseconds, whatever the size of the file). Otherwise
+    reader(path) parses the file and the result is saved for next time.
+
+    Parameters:
+    -----------
+    path : path to the raw file
+    kind : name of the kind of import (e.g. 'calls'), part of the cache key
+    reader : function that parses the raw file into a dataframe
+    cachedir : cache folder (default CACHE_DIR)
+    maxbytes : size limit of the cache folder (default CACHE_SIZE)
+    """
+    cachedir = _cacheFolder(cachedir)
+    entry = _entryPath(path, kind, cachedir)
+    stamp = _fileStamp(path)
+    meta = os.path.join(entry, 'meta.json')
+    if os.path.isfile(meta):
+        with open(meta) as f:
+            info = json.load(f)
+        if info['stamp'] == stamp:
+            os.utime(meta, None)    # mark as recently used
+            return _readColumns(entry, info)
+
+    df = reader(path)
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir)
+    _writeColumns(df, entry, stamp)
+    _evict(cachedir, CACHE_SIZE if maxbytes is None else maxbytes, entry)
+    with open(meta) as f:
+        return _readColumns(entry, json.load(f))
+
+def clearCache(cachedir = None):
+    """Deletes every entry of the cache folder (default CACHE_DIR)."""
+    cachedir = _cacheFolder(cachedir)
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
@@ -3,11 +3,24 @@ Simulate fake call detail records.
 
 """
 
+import os
+import glob
 import networkx as nx
 import random
+import shutil
+import tempfile
+import multiprocessing
+from collections import deque, namedtuple
 import numpy as np
 import pandas as pd
 from scipy.stats import fisk  # Log-logistic distribution for call duration
+from scipy.spatial import cKDTree
+from cdrhelper.misc import _shareArray, _loadShared
+from cdrhelper.cache import cachedFrame
+from cdrhelper.rawfile import RawWriter, writeRaw
+
+POSTAL_DIR = os.path.join(os.path.dirname(os.path.dirname(
+                          os.path.abspath(__file__))), 'postaldata')
 
 def generatePostcode(sourcefile = None, header = 'Postal Code',
                      randombegin = 1000, randomend = 5000):
@@ -31,6 +44,136 @@ def generatePostcode(sourcefile = None, header = 'Postal Code',
         x = pd.read_csv(sourcefile)
     return x
 
+"""
+POSTAL CODE REGISTRY:
+    The country files in postaldata/ are compiled once into the binary cache
+    (see cache.py): postcode, place and state strings become categoricals 
+    (integer codes into the distinct strings) and latitude/longitude 
+    float32. Tables are loaded by ISO code when first asked for and kept for
+    the rest of the session.
+"""
+
+##  Draws postcodes: values[np.searchsorted(cdf, u)] for uniform u. lat and
+##  lon are the coordinates of each value (mean over its places).
+PostcodeSampler = namedtuple('PostcodeSampler', ['values', 'cdf', 'lat', 
+                                                 'lon'])
+
+_postal_tables = {}
+_postal_samplers = {}
+
+def _postalFile(iso, folder = None):
+    """Returns the path of the postal code file of a country."""
+    return os.path.join(folder or POSTAL_DIR, 
+                        '%s_postal_codes.csv' % iso.lower())
+
+def _readPostal(path):
+    """Parses a postaldata/ file into the compact postal table."""
+    try:
+        raw = pd.read_csv(path, dtype = str, keep_default_na = False)
+    except UnicodeDecodeError:
+        ##  Some of the files are Latin-1.
+        raw = pd.read_csv(path, dtype = str, keep_default_na = False, 
+                          encoding = 'latin-1')
+    raw.columns = [c.strip() for c in raw.columns]
+    ##  Several files are padded with empty lines (',,,,').
+    raw = raw[raw[raw.columns[0]].str.strip() != ''].reset_index(drop = True)
+    place = [c for c in raw.columns if c.startswith('Place Name')]
+    state = [c for c in ['State', 'Province', 'District', 'County'] 
+             if c in raw.columns]
+    df = pd.DataFrame({'postcode': raw[raw.columns[0]].str.strip()})
+    for name, cols in [('place', place), ('state', state)]:
+        df[name] = raw[cols[0]].str.strip() if cols else ''
+        df[name] = df[name].replace('', np.nan)
+    for col in ['postcode', 'place', 'state']:
+        df[col] = df[col].astype('category')
+    for name, col in [('lat', 'Latitude'), ('lon', 'Longitude')]:
+        df[name] = pd.to_numeric(raw[col], errors = 'coerce') \
+                     .astype(np.float32)
+    return df
+
+def postalCountries(folder = None):
+    """Returns the ISO codes of the countries in the postal code folder."""
+    files = glob.glob(os.path.join(folder or POSTAL_DIR, '*_postal_codes.csv'))
+    return sorted(os.path.basename(f).split('_')[0] for f in files)
+
+def postalTable(iso, folder = None, cache = True):
+    """Returns the postal code table of a country (memoized).
+    
+    Columns: postcode, place and state (categoricals; state is the first of
+    State, Province, District or County the file has) and lat, lon 
+    (float32). One row per (non-empty) line of the country file.
+    
+    Parameters:
+    -----------
+    iso : two letter country code (e.g. 'de'), see postalCountries()
+    folder : folder of the postal code files (default postaldata/)
+    cache : True (default cache folder), a cache folder or None (parse the 
+        file), see cachedFrame()
+    """
+    key = (iso.lower(), folder)
+    if key not in _postal_tables:
+        path = _postalFile(iso, folder)
+        if cache is None or cache is False:
+            table = _readPostal(path)
+        else:
+            table = cachedFrame(path, 'postal', _readPostal, cachedir = cache)
+        _postal_tables[key] = table
+    return _postal_tables[key]
+
+def postcodeCoords(iso, folder = None, cache = True):
+    """Returns the latitude and longitude of every postcode of a country.
+    
+    Two float64 arrays in the order of the postcode categories of 
+    postalTable(iso) (and of PostcodeSampler.values), averaged over the 
+    places of each postcode. NaN where the file has no coordinates.
+    """
+    table = postalTable(iso, folder, cache)
+    codes = table['postcode'].cat.codes.values
+    size = len(table['postcode'].cat.categories)
+    coords = []
+    for col in ['lat', 'lon']:
+        x = table[col].values.astype(np.float64)
+        ok = (codes >= 0) & ~np.isnan(x)
+        total = np.bincount(codes[ok], weights = x[ok], minlength = size)
+        count = np.bincount(codes[ok], minlength = size)
+        with np.errstate(invalid = 'ignore'):
+            coords.append(total / count)
+    return coords[0], coords[1]
+
+def postcodeSampler(iso, weight = 'rows', folder = None, cache = True):
+    """Returns a PostcodeSampler for makeData() (memoized).
+    
+    Parameters:
+    -----------
+    iso : two letter country code, see postalTable()
+    weight : 'rows' (a postcode is as likely as the number of places it 
+        has, like drawing rows of the file) or 'uniform' (every postcode 
+        alike). Or an array of weights, one per row of postalTable(iso).
+    """
+    named = isinstance(weight, str)
+    key = (iso.lower(), folder, weight)
+    if named and key in _postal_samplers:
+        return _postal_samplers[key]
+    codes = postalTable(iso, folder, cache)['postcode'].cat
+    if named and weight == 'uniform':
+        w = np.ones(len(codes.categories))
+    elif named and weight == 'rows':
+        w = np.bincount(codes.codes[codes.codes >= 0], 
+                        minlength = len(codes.categories))
+    elif named:
+        raise ValueError("Unknown weight: %s" % weight)
+    else:
+        w = np.bincount(codes.codes[codes.codes >= 0], 
+                        weights = np.asarray(weight)[codes.codes >= 0],
+                        minlength = len(codes.categories))
+    cdf = np.cumsum(w, dtype = np.float64)
+    lat, lon = postcodeCoords(iso, folder, cache)
+    sampler = PostcodeSampler(np.asarray(codes.categories, dtype = object), 
+                              cdf / cdf[-1], lat, lon)
+    if named:
+        _postal_samplers[key] = sampler
+    return sampler
+
 def generatePopulation(sourcefile = None, agemax = 106):
     """Returns a vector of weights for each age group.
 
@@ -50,6 +193,323 @@ def generatePopulation(sourcefile = None, agemax = 106):
     ageweight = agexsex.iloc[18: ]['both'].values / float(totalpop)
     return ageweight
 
+"""
+GRAPH GENERATION:
+    Array versions of the networkx generators. These return the edges as an
+    (E, 2) integer array which the rest of the generation pipeline consumes
+    directly; use edgesToGraph() if you need a networkx graph as well.
+"""
+
+def _idType(n):
+    """Returns the smallest of int32/int64 that holds node ids up to n."""
+    return np.int32 if n < 2 ** 31 else np.int64
+
+def _uniqueEdges(u, v):
+    """Returns the sorted (E, 2) array of distinct undirected edges (no loops).
+    """
+    u, v = np.minimum(u, v), np.maximum(u, v)
+    keep = u != v
+    span = np.int64(max(u.max(), v.max()) + 1) if len(u) else 1
+    key = np.unique(u[keep].astype(np.int64) * span + v[keep])
+    return np.column_stack((key // span, key % span)).astype(u.dtype)
+
+def _resolvePointers(ptr):
+    """Follows ptr (each entry points at itself or an earlier one) to the end.
+    
+    Pointer jumping -- every pass doubles the distance followed and only the
+    entries that haven't reached their end are touched again.
+    """
+    ptr = ptr.copy()
+    active = np.flatnonzero(ptr[ptr] != ptr)
+    while len(active):
+        ptr[active] = ptr[ptr[active]]
+        active = active[ptr[ptr[active]] != ptr[active]]
+    return ptr
+
+def barabasiAlbertEdges(n, m, seed = None):
+    """Returns the edges of a Barabasi-Albert graph as an (E, 2) array.
+    
+    Same model as the (pre 2.0) nx.barabasi_albert_graph(): nodes 0 to n - 1,
+    the first m nodes are the targets of node m, and every later node picks 
+    m distinct targets with probability proportional to degree. Built with 
+    the Batagelj-Brandes edge-array method: every new edge copies a random 
+    endpoint of an earlier edge and all edges are resolved at once by 
+    pointer jumping. Targets drawn twice by the same node are redrawn (and 
+    resolved again) until every node has m distinct targets.
+    
+    Parameters
+    ----------
+    n : Number of nodes
+    m : Number of edges to attach from a new node to existing nodes
+    seed : random seed (or numpy Generator) for replication purposes.
+    """
+    if m < 1 or m >= n:
+        raise ValueError("Barabasi-Albert network must have m >= 1 and m < n,"
+                         " m = %d, n = %d" % (m, n))
+    rng = _rng(seed)
+    idtype = _idType(2 * m * n)
+    E = m * (n - m)
+    
+    ## Edge j (from source[j]) copies endpoint slot r of an earlier edge: 
+    ##  even slots are sources (known right away), odd slots are the target
+    ##  of edge r // 2 (follow the pointer). Node m links to the first m nodes.
+    source = m + np.arange(E, dtype = idtype) // m
+    value = np.empty(E, dtype = idtype)
+    value[:m] = np.arange(m)
+    ptr = np.arange(E, dtype = idtype)
+    target = np.full(E, -1, dtype = idtype)
+    target[:m] = value[:m]
+    redraw = np.arange(m, E)
+    while len(redraw):
+        r = (rng.random(len(redraw)) * 
+             (2 * m * (source[redraw] - m))).astype(idtype)
+        odd = (r % 2) == 1
+        value[redraw] = source[r // 2]
+        ptr[redraw] = np.where(odd, r // 2, redraw)
+        new = value[_resolvePointers(ptr)]
+        
+        ## Repeated targets (within a node's m edges) get redrawn. Only the
+        ##  nodes with redrawn or changed targets need checking.
+        rows = np.unique(np.concatenate((redraw, 
+                                         np.flatnonzero(new != target))) // m)
+        target = new
+        block = target.reshape(-1, m)[rows]
+        order = np.argsort(block, axis = 1, kind = 'stable')
+        sort_b = np.take_along_axis(block, order, axis = 1)
+        dup = np.zeros(block.shape, dtype = bool)
+        np.put_along_axis(dup, order[:, 1:], sort_b[:, 1:] == sort_b[:, :-1],
+                          axis = 1)
+        i, j = np.nonzero(dup)
+        redraw = rows[i] * m + j
+    return np.column_stack((target, source))
+
+def configurationEdges(degrees, seed = None):
+    """Returns the edges of a configuration model graph as an (E, 2) array.
+    
+    Pairs up shuffled edge stubs (node i gets degrees[i] of them). Like 
+    nx.Graph(nx.configuration_model()), self-loops and parallel edges are 
+    dropped, so realized degrees can come out a little lower.
+    """
+    degrees = np.asarray(degrees)
+    if degrees.sum() % 2 != 0 or (degrees < 0).any():
+        raise ValueError("Invalid degree sequence")
+    rng = _rng(seed)
+    stubs = np.repeat(np.arange(len(degrees), dtype = _idType(len(degrees))),
+                      degrees)
+    rng.shuffle(stubs)
+    return _uniqueEdges(stubs[0::2], stubs[1::2])
+
+def blockEdges(sizes, p, seed = None):
+    """Returns the edges of a stochastic block model graph as an (E, 2) array.
+    
+    Nodes are numbered block by block. For every pair of blocks, the number
+    of edges is drawn from a binomial and that many distinct node pairs are 
+    drawn -- the cost is linear in the number of edges rather than quadratic
+    in the number of nodes.
+    
+    Parameters
+    ----------
+    sizes : Number of nodes in each block
+    p : Symmetric matrix of edge probabilities between (and within) blocks
+    seed : random seed (or numpy Generator) for replication purposes.
+    """
+    sizes = np.asarray(sizes, dtype = np.int64)
+    p = np.asarray(p, dtype = float)
+    rng = _rng(seed)
+    idtype = _idType(sizes.sum())
+    starts = np.cumsum(sizes) - sizes
+    blocks = []
+    for a in range(len(sizes)):
+        for b in range(a, len(sizes)):
+            na, nb = sizes[a], sizes[b]
+            pairs = na * (na - 1) // 2 if a == b else na * nb
+            count = rng.binomial(pairs, p[a, b]) if pairs else 0
+            found = np.empty((0, 2), dtype = idtype)
+            while len(found) < count:
+                k = count - len(found)
+                u = starts[a] + rng.integers(0, na, size = k)
+                v = starts[b] + rng.integers(0, nb, size = k)
+                drawn = _uniqueEdges(u.astype(idtype), v.astype(idtype))
+                found = np.unique(np.vstack((found, drawn)), axis = 0)
+            blocks.append(found[rng.permutation(len(found))[:count]])
+    edges = np.vstack(blocks)
+    return edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+
+def edgesToGraph(edges, nodes = None):
+    """Returns a networkx Graph built from an (E, 2) edge array.
+    
+    Parameters
+    ----------
+    edges : (E, 2) array of edges, e.g. from barabasiAlbertEdges()
+    nodes : optional list of nodes to add (to keep isolated nodes)
+    """
+    G = nx.Graph()
+    if nodes is not None:
+        G.add_nodes_from(nodes)
+    G.add_edges_from(np.asarray(edges).tolist())
+    return G
+
+def _nodeArray(G):
+    """Returns the nodes of a graph or of an (E, 2) edge array."""
+    if isinstance(G, np.ndarray):
+        return np.unique(G)
+    return list(G.nodes())
+
+"""
+SPATIAL NETWORKS:
+    Subscribers live at postcodes (see postcodeSampler()) and tie to other 
+    subscribers with probability decaying with the distance between their 
+    postcodes. Candidates come from a k-d tree over the occupied postcodes 
+    (points on the unit sphere): every postcode only weighs its k nearest 
+    occupied postcodes, so generation is O(n k log n) instead of O(n^2).
+"""
+
+EARTH_RADIUS = 6371.0088    # km, mean radius
+
+def _unitVectors(lat, lon):
+    """Returns the (n, 3) points of the unit sphere at lat/lon (degrees)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack((np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+def placeNodes(n, sampler, seed = None):
+    """Returns the home postcode of n nodes as indices into sampler.values.
+    
+    Draws like makeData() does, but only from postcodes with coordinates.
+    
+    Parameters
+    ----------
+    n : Number of nodes
+    sampler : PostcodeSampler, see postcodeSampler()
+    seed : random seed (or numpy Generator) for replication purposes.
+    """
+    w = np.diff(sampler.cdf, prepend = 0.)
+    w[np.isnan(sampler.lat) | np.isnan(sampler.lon)] = 0
+    cdf = np.cumsum(w)
+    u = _rng(seed).random(n) * cdf[-1]
+    return np.minimum(np.searchsorted(cdf, u, side = 'right'), 
+                      len(cdf) - 1).astype(_idType(len(cdf)))
+
+def _spatialKernel(home, lat, lon, scale, k):
+    """Returns the tables _spatialTargets() draws from.
+    
+    For every occupied postcode: its k nearest occupied postcodes and the 
+    cumulative weights (subscribers there * exp(-km / scale)) of picking 
+    each. Plus the nodes grouped by postcode.
+    """
+    lat = np.asarray(lat, dtype = np.float64)
+    lon = np.asarray(lon, dtype = np.float64)
+    count = np.bincount(home, minlength = len(lat))
+    occupied = np.flatnonzero(count)
+    row = np.full(len(lat), -1, dtype = np.int64)
+    row[occupied] = np.arange(len(occupied))
+    k = min(k, len(occupied))
+    xyz = _unitVectors(lat[occupied], lon[occupied])
+    chord, near = cKDTree(xyz).query(xyz, k = k)
+    chord = chord.reshape(len(occupied), k)
+    near = occupied[near.reshape(len(occupied), k)]
+    km = 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1))
+    cdf = np.cumsum(count[near] * np.exp(-km / scale), axis = 1)
+    cdf /= cdf[:, -1:]
+    members = np.argsort(home, kind = 'stable')
+    start = np.cumsum(count) - count
+    return (row, near, cdf, members, start, count)
+
+def _spatialTargets(kernel, source, longrange, rng, batch = 2 ** 18):
+    """Draws a tie partner for every node in source (see spatialEdges())."""
+    row, near, cdf, members, start, count = kernel
+    target = np.empty(len(source), dtype = np.int64)
+    for lo in range(0, len(source), batch):
+        r = row[source[lo:lo + batch]]
+        u = rng.random(len(r))
+        j = np.minimum((cdf[r] < u[:, None]).sum(axis = 1), near.shape[1] - 1)
+        q = near[r, j]
+        pick = (rng.random(len(r)) * count[q]).astype(np.int64)
+        target[lo:lo + batch] = members[start[q] + pick]
+    jump = np.flatnonzero(rng.random(len(source)) < longrange)
+    target[jump] = rng.integers(0, len(members), size = len(jump))
+    return target
+
+def spatialEdges(home, lat, lon, m = 2, scale = 10., k = 32, longrange = .01,
+                 seed = None):
+    """Returns the edges of a spatial network as an (E, 2) array.
+    
+    Every node 0 to n - 1 draws m partners: a postcode among the k occupied
+    postcodes nearest its own, with probability proportional to the number 
+    of subscribers there times exp(-distance / scale), then a subscriber of
+    that postcode at random. A fraction longrange of the partners is drawn
+    uniformly instead (the odd far away tie). Loops and duplicates are 
+    dropped, so the mean degree is a little under 2 * m.
+    
+    Parameters
+    ----------
+    home : Home postcode of each node (index into lat/lon), see placeNodes()
+    lat, lon : Coordinates (degrees) of each postcode, e.g. 
+        PostcodeSampler.lat and .lon
+    m : Number of ties each node forms
+    scale : Distance decay of the kernel in km
+    k : Number of nearest occupied postcodes considered per postcode
+    longrange : Probability of a uniformly drawn partner instead
+    seed : random seed (or numpy Generator) for replication purposes.
+    """
+    home = np.asarray(home)
+    rng = _rng(seed)
+    kernel = _spatialKernel(home, lat, lon, scale, k)
+    u = np.repeat(np.arange(len(home), dtype = np.int64), m)
+    v = _spatialTargets(kernel, home[u], longrange, rng)
+    idtype = _idType(len(home))
+    return _uniqueEdges(u.astype(idtype), v.astype(idtype))
+
+def rewireSpatial(edges, home, lat, lon, p = .1, scale = 10., k = 32, 
+                  longrange = 0., redraws = 10, seed = None):
+    """Returns edges with a fraction p of them rewired to nearby partners.
+    
+    For every rewired edge, one endpoint (at random) keeps it and the other
+    is replaced by a partner drawn with the distance-decay kernel of 
+    spatialEdges(). A Barabasi-Albert network (node ids 0 to n - 1) thus 
+    keeps most of the ties of its hubs but gains local clustering.
+    
+    A rewired edge that lands on a loop or on an edge that is already there
+    is redrawn, up to redraws times. The few that still collide (nodes whose
+    nearby partners are all taken) are dropped, so the result can have a 
+    few edges less than edges.
+    
+    Parameters
+    ----------
+    edges : (E, 2) array of edges, e.g. from barabasiAlbertEdges()
+    home : Home postcode of each node (index into lat/lon), see placeNodes()
+    p : Fraction of edges to rewire
+    redraws : Number of times a colliding rewired edge is drawn again
+    See spatialEdges() for the others.
+    """
+    edges = np.asarray(edges)
+    home = np.asarray(home)
+    rng = _rng(seed)
+    kernel = _spatialKernel(home, lat, lon, scale, k)
+    u, v = edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64)
+    flip = rng.random(len(u)) < .5
+    u[flip], v[flip] = v[flip], u[flip]
+    move = np.flatnonzero(rng.random(len(u)) < p)
+    for attempt in range(redraws + 1):
+        if len(move) == 0:
+            break
+        v[move] = _spatialTargets(kernel, home[u[move]], longrange, rng)
+        move = move[_collisions(u, v, move)]
+    return _uniqueEdges(u.astype(edges.dtype), v.astype(edges.dtype))
+
+def _collisions(u, v, move):
+    """Returns which of the rewired edges (positions move) are loops or 
+    repeat another edge. Of the copies of an edge, the one that wasn't 
+    rewired (else the first) is kept."""
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    key = lo * np.int64(hi.max() + 1) + hi
+    moved = np.zeros(len(u), dtype = bool)
+    moved[move] = True
+    order = np.lexsort((moved, key))
+    repeat = np.zeros(len(u), dtype = bool)
+    repeat[order[1:]] = key[order][1:] == key[order][:-1]
+    return (repeat | (u == v))[move]
+
 """
 DATA GENERATION:
     Works in three steps: 
@@ -61,13 +521,182 @@ DATA GENERATION:
 """
 
 
+def _rng(seed = None):
+    """Returns a numpy Generator for seed (passes Generators through)."""
+    return np.random.default_rng(seed)
+
+def _spawnSeeds(seed, n):
+    """Returns n independent SeedSequences spawned from seed (None, an int,
+    a SeedSequence or a numpy Generator)."""
+    if isinstance(seed, np.random.Generator):
+        seed = seed.integers(2 ** 63)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(n)
+
+def _edgeArray(G):
+    """Returns the edges of G as an (E, 2) array. Arrays are passed through."""
+    if isinstance(G, np.ndarray):
+        return G
+    return np.asarray(list(G.edges())).reshape(-1, 2)
+
+def aliasTable(weights):
+    """Returns a Walker/Vose alias table (prob, alias) for weights.
+    
+    Build it once and use it for any number of weighted draws at O(1) each
+    (see generateDateCallers()). Vectorized Vose construction: in every 
+    round, each 'small' column (below the average weight) is topped up by 
+    the 'large' column whose excess covers the start of its deficit (one 
+    cumsum + searchsorted); large columns that drop below the average become
+    the small ones of the next round.
+    
+    Parameters
+    ----------
+    weights : Non-negative weights (need not sum to 1), e.g. edgeActivity()
+    """
+    w = np.asarray(weights, dtype = float)
+    n = len(w)
+    if n == 0 or (w < 0).any() or not w.sum() > 0:
+        raise ValueError("Weights must be non-negative with a positive sum.")
+    q = w * (n / w.sum())
+    prob = np.ones(n)
+    alias = np.arange(n, dtype = _idType(n))
+    small = np.flatnonzero(q < 1)
+    large = np.flatnonzero(q >= 1)
+    while len(small) and len(large):
+        deficit = 1 - q[small]
+        j = np.searchsorted(np.cumsum(q[large] - 1), 
+                            np.cumsum(deficit) - deficit, side = 'right')
+        ok = j < len(large)     # leftovers from round-off go another round
+        if not ok.any():
+            break
+        prob[small[ok]] = q[small[ok]]
+        alias[small[ok]] = large[j[ok]]
+        q[large] -= np.bincount(j[ok], weights = deficit[ok], 
+                                minlength = len(large))
+        small = np.concatenate((large[q[large] < 1], small[~ok]))
+        large = large[q[large] >= 1]
+    return (prob, alias)
+
+def _aliasDraw(table, size, rng):
+    """Returns size draws (indices) from an aliasTable()."""
+    prob, alias = table
+    i = rng.integers(0, len(prob), size = size)
+    return np.where(rng.random(size) < prob[i], i, alias[i])
+
+def _aliasProb(table):
+    """Returns the probability of each index under an aliasTable()."""
+    prob, alias = table
+    p = prob + np.bincount(alias, weights = 1 - prob, minlength = len(prob))
+    return p / p.sum()
+
+def edgeActivity(G, activity = 'degree', shape = 2., seed = None):
+    """Returns a weight for every edge of G (in _edgeArray() order).
+    
+    The weight of edge (u, v) is the product of the activities of u and v,
+    so a few very active subscribers (and the ties between them) carry most
+    of the traffic.
+    
+    Parameters
+    ----------
+    G : NetworkX graph or an (E, 2) array of edges
+    activity : How to get node activities:
+        'degree' : the degree of the node
+        'pareto' : drawn from a Pareto (Lomax + 1) distribution with shape
+        a function f(rng, n) that returns n node activities
+        an array with one weight per edge (returned as is)
+    shape : Shape of the Pareto distribution (smaller = heavier tail)
+    seed : random seed (or numpy Generator) for replication purposes.
+    """
+    edges = _edgeArray(G)
+    if not isinstance(activity, str) and not callable(activity):
+        weights = np.asarray(activity, dtype = float)
+        if len(weights) != len(edges):
+            raise ValueError("Need one activity weight per edge.")
+        return weights
+    nodes, ends = np.unique(edges, return_inverse = True)
+    ends = ends.reshape(-1, 2)
+    if activity == 'degree':
+        a = np.bincount(ends.ravel(), minlength = len(nodes)).astype(float)
+    elif activity == 'pareto':
+        a = _rng(seed).pareto(shape, len(nodes)) + 1
+    elif callable(activity):
+        a = np.asarray(activity(_rng(seed), len(nodes)), dtype = float)
+    else:
+        raise ValueError("Unknown activity: %s" % activity)
+    return a[ends[:, 0]] * a[ends[:, 1]]
+
+def _sampleEdges(m, counts, rng, table = None, maxrounds = 50):
+    """Returns edge indices with counts[d] distinct edges (of m) for each day.
+
+    All days are drawn at once with replacement and the few draws that repeat
+    an edge within the same day are redrawn until each day is duplicate-free
+    (same result as a random.sample() per day). Days that want more than half
+    of all edges are drawn by permutation since rejection would crawl there.
+    
+    If table (an aliasTable() over the edges) is given, edges are drawn by
+    weight, successively without replacement within a day. Days that still 
+    have duplicates after maxrounds redraws (very concentrated weights) are 
+    drawn with rng.choice() instead.
+    """
+    counts = np.asarray(counts)
+    if (counts > m).any():
+        raise ValueError("Sample larger than population (edges in G).")
+    if table is None:
+        draw = lambda k: rng.integers(0, m, size = k)
+        p = None
+    else:
+        draw = lambda k: _aliasDraw(table, k, rng)
+        p = _aliasProb(table)
+    day = np.repeat(np.arange(len(counts)), counts)
+    idx = draw(len(day)) if m else np.zeros(0, dtype = np.int64)
+    
+    ## Dense days: one permutation draw each.
+    starts = np.cumsum(counts) - counts
+    dense = counts > m // 2
+    for d in np.flatnonzero(dense & (counts > 0)):
+        idx[starts[d]:starts[d] + counts[d]] = rng.choice(m, counts[d], 
+                                                          replace = False,
+                                                          p = p)
+    
+    ## Sparse days: redraw within-day duplicates until there are none. Only
+    ##  the redrawn rows are checked against the (sorted) accepted keys.
+    rows = np.flatnonzero(~dense[day])
+    key = day[rows] * np.int64(m) + idx[rows]
+    order = np.argsort(key)
+    key = key[order]
+    dup = np.zeros(len(rows), dtype = bool)
+    dup[1:] = key[1:] == key[:-1]
+    accepted = key[~dup]
+    pending = rows[order[dup]]
+    rounds = 0
+    while len(pending) and rounds < maxrounds:
+        idx[pending] = draw(len(pending))
+        key = day[pending] * np.int64(m) + idx[pending]
+        pos = np.minimum(np.searchsorted(accepted, key), len(accepted) - 1)
+        taken = accepted[pos] == key
+        first = np.zeros(len(pending), dtype = bool)
+        first[np.unique(key, return_index = True)[1]] = True
+        ok = first & ~taken
+        new = np.sort(key[ok])
+        accepted = np.insert(accepted, np.searchsorted(accepted, new), new)
+        pending = pending[~ok]
+        rounds += 1
+    for d in np.unique(day[pending]):
+        idx[starts[d]:starts[d] + counts[d]] = rng.choice(m, counts[d], 
+                                                          replace = False,
+                                                          p = p)
+    return idx
+
 def generateDateCallers(G, days = 90, callsperday = 20, 
-                        startdate = '20130101', seed = None):
+                        startdate = '20130101', seed = None, 
+                        engine = 'numpy', activity = None):
     """Returns a dataframe with dates, caller, and recipient.
     
     This outputs a pandas dataframe filled with repeating dates and calls 
     between u and v. Each line will represent a single observation (edge) 
-    for that day based on an underlying graph, G.
+    for that day based on an underlying graph, G. With the numpy engine, the 
+    rows are sorted by date and A_num.
     
     Parameters
     ----------
@@ -75,9 +704,53 @@ def generateDateCallers(G, days = 90, callsperday = 20,
     startdate : When the daterange should start. (default = '20130101')
     callsperday : The number of observations (callers) per day. Drawn from a
         Poisson distribution. (default = 20)
-    G : NetworkX graph to select edges from.
-    seed : random seed for replication purposes.
+    G : NetworkX graph (or an (E, 2) array of edges) to select edges from.
+    seed : random seed (or numpy Generator) for replication purposes.
+    engine : 'numpy' (default) turns G into an edge array once and draws the
+        edges and directions for all days in batched calls. 'python' is the
+        original random.sample() version.
+    activity : None (default) picks edges uniformly. Otherwise edges are 
+        picked by weight: pass an aliasTable() (build it once and reuse it)
+        or anything edgeActivity() takes, e.g. 'degree' or 'pareto'. 
+        (numpy engine only)
     """
+    if engine == 'python':
+        return _generateDateCallersPython(G, days, callsperday, startdate, 
+                                          seed)
+    elif engine != 'numpy':
+        raise ValueError("Unknown engine: %s" % engine)
+    
+    rng = _rng(seed)
+    E = rng.poisson(callsperday, days)
+    dates = np.asarray(pd.date_range(startdate, periods = days)
+                       .strftime('%Y%m%d'), dtype = object)
+    
+    ## Pick the edges for every day, then flip a coin for each one so that
+    ##  A_num won't always be the lower numbered node.
+    edges = _edgeArray(G)
+    table = _activityTable(edges, activity, rng)
+    sample_e = edges[_sampleEdges(len(edges), E, rng, table)]
+    flip = rng.random(len(sample_e)) < .5
+    u = np.where(flip, sample_e[:, 1], sample_e[:, 0])
+    v = np.where(flip, sample_e[:, 0], sample_e[:, 1])
+    
+    ## Sort by date and A_num (like a real CDR file) so reciprocate() can 
+    ##  merge into it without re-sorting.
+    day = np.repeat(np.arange(days), E)
+    order = np.lexsort((u, day))
+    df = pd.DataFrame({'date': dates[day[order]], 'A_num': u[order], 
+                       'B_num': v[order]}, 
+                      columns = ['date', 'A_num', 'B_num'])
+    return(df)
+
+def _activityTable(edges, activity, seed = None):
+    """Returns an aliasTable() for activity (None and tables pass through)."""
+    if activity is None or isinstance(activity, tuple):
+        return activity
+    return aliasTable(edgeActivity(edges, activity, seed = seed))
+
+def _generateDateCallersPython(G, days, callsperday, startdate, seed):
+    """Original (pure Python) version of generateDateCallers()."""
     if seed is not None:
         random.seed(seed)
     
@@ -100,8 +773,24 @@ def generateDateCallers(G, days = 90, callsperday = 20,
     df['B_num'] = v
     return(df)
 
+def _callMinutes(calls, call_dur, rng):
+    """Returns the total (rounded) minutes for each row of call counts.
+    
+    Draws every call duration in one fisk.rvs() call and sums them per row
+    with a segmented reduction (np.add.reduceat) over the row offsets.
+    """
+    calls = np.asarray(calls)
+    mins = np.zeros(len(calls))
+    rows = np.flatnonzero(calls > 0)
+    if len(rows):
+        durations = fisk.rvs(call_dur, size = calls.sum(), random_state = rng)
+        offsets = np.cumsum(calls[rows]) - calls[rows]
+        mins[rows] = np.add.reduceat(durations, offsets)
+    return np.round(mins, 1)
+
 def generateCallData(data, mean_calls = 5, call_dur = 1.15, 
-                    mean_sms = 25, mean_mms = 10, seed = None):
+                    mean_sms = 25, mean_mms = 10, seed = None, 
+                    engine = 'numpy'):
     """Takes a generateDateCallers() dataframe and returns one with call info.
     
     This new dataframe will contain four new columns:
@@ -119,7 +808,28 @@ def generateCallData(data, mean_calls = 5, call_dur = 1.15,
         duration of calls. (Note: Drawn multiple times and then summed over.)
     mean_sms : mean of Poisson distribution from which to draw SMS data
     mean_mms : mean of Poisson distribution from which to draw MMS data
+    seed : random seed (or numpy Generator) shared by all of the draws.
+    engine : 'numpy' (default) draws all call durations in one batch. 
+        'python' is the original one-scipy-call-per-row version.
     """
+    if engine == 'python':
+        return _generateCallDataPython(data, mean_calls, call_dur, mean_sms,
+                                       mean_mms, seed)
+    elif engine != 'numpy':
+        raise ValueError("Unknown engine: %s" % engine)
+    
+    dfrows = len(data)
+    rng = _rng(seed)
+    calls = rng.poisson(mean_calls, dfrows)
+    data['calls'] = calls
+    data['min'] = _callMinutes(calls, call_dur, rng)
+    data['sms'] = rng.poisson(mean_sms, dfrows)
+    data['mms'] = rng.poisson(mean_mms, dfrows)
+    return(data)
+
+def _generateCallDataPython(data, mean_calls, call_dur, mean_sms, mean_mms, 
+                            seed):
+    """Original (row by row) version of generateCallData()."""
     dfrows = len(data)
     if seed is not None:
         random.seed(seed)
@@ -131,46 +841,91 @@ def generateCallData(data, mean_calls = 5, call_dur = 1.15,
     return(data)
 
 ##  Reciprocating calls function
-def reciprocate(df_call, r_prob = .33):
+def _sortKey(day, num):
+    """Returns a single int64 (day, num) sort key or None if num won't fit."""
+    if not np.issubdtype(num.dtype, np.integer) or len(num) == 0:
+        return None
+    lo, hi = num.min(), num.max()
+    span = int(hi) - int(lo) + 1
+    if span * (int(day.max()) + 1) >= 2 ** 62:
+        return None
+    return day.astype(np.int64) * span + (num - lo)
+
+def _mergeSorted(df, df2, key, key2):
+    """Merges two dataframes sorted by key and key2 into one sorted frame.
+    
+    Rows of df2 go after the rows of df with the same key. Linear merge via
+    searchsorted -- nothing is re-sorted.
+    """
+    n, r = len(df), len(df2)
+    pos = np.searchsorted(key, key2, side = 'right') + np.arange(r)
+    is2 = np.zeros(n + r, dtype = bool)
+    is2[pos] = True
+    take = np.empty(n + r, dtype = np.int64)
+    take[~is2] = np.arange(n)
+    take[is2] = n + np.arange(r)
+    df3 = pd.concat([df, df2], ignore_index = True)
+    return df3.iloc[take].reset_index(drop = True)
+
+def reciprocate(df_call, r_prob = .33, seed = None):
     """Takes a generateCallData() dataframe and reciprocates calls randomly. 
     
     Randomly selects r_prob proportion for each day in a generateCallData() df
-    and then generates reciprocating call data. 
-    """
+    and then generates reciprocating call data. The result is sorted by date
+    and A_num.
     
-    # Make a list of randomly selected indices for each day in the original
-    subindex = []
-    for day in pd.unique(df_call['date']):
-        cdayi = df_call[df_call['date'] == day].index.tolist()
-        subsample = random.sample(cdayi, int(r_prob * len(cdayi)))
-        subindex.append(subsample)
-    subindex = [item for sublist in subindex for item in sublist]
+    Everything is done in one pass: each row gets a random rank within its
+    day, the rows ranked below int(r_prob * rows that day) are swapped and 
+    get new call data in one batch, then they are merged into the (sorted)
+    original.
+    """
+    rng = _rng(seed)
+    df_call = df_call.reset_index(drop = True)
+    day = pd.factorize(df_call['date'], sort = True)[0]
     
-    # Get the new subsample and three columns we need
-    df2 = df_call.ix[subindex, :3]
+    # Randomly rank the rows within each day and keep the first r_prob of them
+    counts = np.bincount(day)
+    keep = (r_prob * counts).astype(np.int64)
+    perm = rng.permutation(len(day))
+    order = perm[np.argsort(day[perm].astype(np.min_scalar_type(len(counts))),
+                            kind = 'stable')]
+    rank = np.arange(len(day)) - (np.cumsum(counts) - counts)[day[order]]
+    subindex = np.sort(order[rank < keep[day[order]]])
     
     # Swap the A_num and B_num columns (reciprocate calls)
-    df2.rename(columns = {"A_num" : "B_num", "B_num" : "A_num"}, inplace = True)
-    
-    # Reorder the columns back to the original for consistency
-    df2 = df2.ix[:, [0, 2, 1]]
+    df2 = pd.DataFrame({'date': df_call['date'].values[subindex],
+                        'A_num': df_call['B_num'].values[subindex],
+                        'B_num': df_call['A_num'].values[subindex]},
+                       columns = ['date', 'A_num', 'B_num'])
     
     # Regenerate new call data
-    df2 = generateCallData(data = df2)
-    
-    # Append to old dataframe; sort it
-    df3 = df_call.append(df2)
-    df3 = df3.sort(columns = ["date", "A_num"])
+    df2 = generateCallData(data = df2, seed = rng)
     
-    # Return data
-    return df3
+    # Merge into the old dataframe by (date, A_num). Only the new rows (and
+    # the old ones, if they aren't sorted already) need sorting.
+    A, A2 = df_call['A_num'].values, df2['A_num'].values
+    key = _sortKey(np.concatenate([day, day[subindex]]), 
+                   np.concatenate([A, A2]))
+    if key is None:
+        df3 = pd.concat([df_call, df2], ignore_index = True)
+        return df3.sort_values(["date", "A_num"], kind = 'stable', 
+                               ignore_index = True)
+    key, key2 = key[:len(A)], key[len(A):]
+    if (np.diff(key) < 0).any():
+        order = np.argsort(key, kind = 'stable')
+        df_call, key = df_call.iloc[order], key[order]
+    order2 = np.argsort(key2, kind = 'stable')
+    return _mergeSorted(df_call, df2.iloc[order2], key, key2[order2])
 
 def makeData(postcodes, ageweight, nodes = 30, edges = 10, days = 10,
                 callsperday = 20, startdate = "20130101", 
                 mean_calls = 5, call_dur = 1.15,
                 mean_sms = 25, mean_mms = 10, 
                 r_prob = .33, seed = None,
-                maleid = "M", femaleid = "F"):
+                maleid = "M", femaleid = "F", 
+                chunkdays = None, processes = None,
+                backend = 'networkx', graph = None, activity = None,
+                spatial = None):
     """Returns 1 graph and two dataframes -- one for attributes; one for calls.
     
     Uses generateCallData(), generateDateCallers(), and reciprocate() to return
@@ -182,30 +937,278 @@ def makeData(postcodes, ageweight, nodes = 30, edges = 10, days = 10,
     complete datesets and the underlying graph upon which it is based. 
         
     For missingness, see insertMissing().
+    
+    Set chunkdays and/or processes to generate the calls chunk by chunk 
+    (default chunkdays = 1) over a pool of processes, see 
+    generateCallChunks(). The result only depends on seed and chunkdays, not
+    on the number of processes.
+    
+    For big populations, backend = 'array' builds the Barabasi-Albert network
+    directly as an (E, 2) edge array (see barabasiAlbertEdges()) and returns
+    that instead of a networkx graph -- use edgesToGraph() if you need one.
+    Pass graph (a networkx graph or an edge array, e.g. from 
+    configurationEdges() or blockEdges()) to use your own network instead.
+    
+    postcodes can be the generatePostcode() dataframe or a PostcodeSampler 
+    (see postcodeSampler()), which draws from precomputed arrays.
+    
+    Set activity (e.g. 'degree' or 'pareto', see edgeActivity()) to pick the
+    daily edges by weight instead of uniformly. The alias table is built 
+    once and reused for every day.
+    
+    Set spatial (a distance scale in km) with a PostcodeSampler to build a 
+    spatial network instead: nodes are placed at postcodes (see 
+    placeNodes()), each forms edges ties with a distance-decay kernel (see 
+    spatialEdges()) and the postcode of each node in attr is its home.
+        
+    The graph, the activity weights, the calls and the attributes each get 
+    their own seed stream spawned from seed, so the same seed gives the same
+    output.
         
     Example usage: 'G, df, attr = makeData()'
     """
+    graphseed, activityseed, callseed, attrseed = _spawnSeeds(seed, 4)
+    G, home = _generateGraph(nodes = nodes, edges = edges, seed = graphseed,
+                             backend = backend, graph = graph, 
+                             postcodes = postcodes, spatial = spatial)
+    
+    if (chunkdays is not None) or (processes is not None):
+        df = pd.concat(generateCallChunks(G, days = days, 
+                                          chunkdays = chunkdays or 1,
+                                          callsperday = callsperday, 
+                                          startdate = startdate, 
+                                          mean_calls = mean_calls, 
+                                          call_dur = call_dur, 
+                                          mean_sms = mean_sms, 
+                                          mean_mms = mean_mms, 
+                                          r_prob = r_prob, 
+                                          seed = callseed,
+                                          processes = processes, 
+                                          activity = activity),
+                       ignore_index = True)
+    else:
+        rng = _rng(callseed)
+        E = _edgeArray(G)
+        df = generateDateCallers(G = E, days = days, 
+                                 callsperday = callsperday, 
+                                 startdate = startdate, seed = rng,
+                                 activity = _activityTable(E, activity, 
+                                                           activityseed))
+        
+        df = generateCallData(data = df, mean_calls = mean_calls, 
+                              call_dur = call_dur, mean_sms = mean_sms, 
+                              mean_mms = mean_mms, seed = rng)
+        
+        df = reciprocate(df_call = df, r_prob = r_prob, seed = rng)
+    
+    attr = _generateAttr(G, postcodes, ageweight, maleid, femaleid, home,
+                         seed = attrseed)
+    
+    return(G, df, attr)
+
+def _generateGraph(nodes, edges, seed = None, backend = 'networkx', 
+                   graph = None, postcodes = None, spatial = None):
+    """Returns the underlying graph used by makeData() and the node homes.
+    
+    Barabasi-Albert by default (home is None). backend = 'array' returns 
+    the graph as an (E, 2) edge array (see barabasiAlbertEdges()). If graph
+    is given, it is used as is. With spatial, nodes 0 to nodes - 1 are 
+    placed at postcodes and tied by spatialEdges(); home holds the index 
+    into postcodes.values of each node.
+    """
+    if graph is not None:
+        return graph, None
+    if backend not in ['array', 'networkx']:
+        raise ValueError("Unknown backend: %s" % backend)
+    if spatial is not None:
+        if not isinstance(postcodes, PostcodeSampler):
+            raise ValueError("spatial needs a PostcodeSampler")
+        rng = _rng(seed)
+        home = placeNodes(nodes, postcodes, seed = rng)
+        G = spatialEdges(home, postcodes.lat, postcodes.lon, m = edges, 
+                         scale = spatial, seed = rng)
+        if backend == 'networkx':
+            G = edgesToGraph(G, nodes = range(nodes))
+        return G, home
+    if backend == 'array':
+        G = barabasiAlbertEdges(n = nodes, m = edges, seed = seed)
+        return G[(G != 0).all(axis = 1)], None
+    if isinstance(seed, np.random.SeedSequence):
+        seed = int(seed.generate_state(1)[0])
     G = nx.barabasi_albert_graph(n = nodes, m = edges, seed = seed)
     G.remove_node(0) # testing something out -- think errors are because of 0.
-    
-    df = generateDateCallers(G = G, days = days, 
+    return G, None
+
+def _generateAttr(G, postcodes, ageweight, maleid = "M", femaleid = "F",
+                  home = None, seed = None):
+    """Returns the attribute dataframe for every node in G."""
+    rng = _rng(seed)
+    attr = pd.DataFrame(data = _nodeArray(G), columns = ['A_num'])
+    attrrows = len(attr)
+    if home is not None:
+        attr['postcode'] = postcodes.values[home[attr['A_num'].values]]
+    elif isinstance(postcodes, PostcodeSampler):
+        attr['postcode'] = postcodes.values[np.searchsorted(
+            postcodes.cdf, rng.random(attrrows), side = 'right')]
+    else:
+        attr['postcode'] = rng.choice(np.asarray(postcodes['Postal Code']), 
+                                      attrrows)
+    attr['gender'] = rng.choice([femaleid, maleid], attrrows)
+    attr['age'] = rng.choice(np.arange(18, 106), p = ageweight, 
+                             size = attrrows)
+    return attr
+
+"""
+STREAMING GENERATION:
+    Same three steps as above, but run on consecutive chunks of days so that
+    only one chunk of call data is ever in memory. Each chunk gets its own 
+    seed stream (spawned from the master seed) so the output only depends on
+    the seed and the chunk size.
+"""
+
+def _callChunk(edges, table, startdate, days, callsperday, mean_calls, 
+               call_dur, mean_sms, mean_mms, r_prob, seed):
+    """Returns the (reciprocated) call data for a single chunk of days."""
+    rng = _rng(seed)
+    df = generateDateCallers(G = edges, days = days, 
                              callsperday = callsperday, 
-                             startdate = startdate, seed = seed)
-    
+                             startdate = startdate, seed = rng,
+                             activity = table)
     df = generateCallData(data = df, mean_calls = mean_calls, 
                           call_dur = call_dur, mean_sms = mean_sms, 
-                          mean_mms = mean_mms, seed = seed)
+                          mean_mms = mean_mms, seed = rng)
+    return reciprocate(df_call = df, r_prob = r_prob, seed = rng)
+
+def _chunkArgs(days, chunkdays, startdate, seed):
+    """Returns (startdate, days, seed) for every chunk of the date range."""
+    starts = range(0, days, chunkdays)
+    firstday = pd.Timestamp(startdate)
+    seeds = _spawnSeeds(seed, len(starts))
+    return [((firstday + pd.Timedelta(days = x)).strftime('%Y%m%d'), 
+             min(chunkdays, days - x), ss) for x, ss in zip(starts, seeds)]
+
+_worker_edges = None
+_worker_table = None
+
+def _initChunkWorker(edges, table):
+    """Pool initializer -- opens the shared arrays once per worker."""
+    global _worker_edges, _worker_table
+    _worker_edges = _loadShared(edges)
+    if table is not None:
+        _worker_table = tuple(_loadShared(x) for x in table)
+
+def _chunkWorker(args):
+    """Pool task -- generates one chunk against the shared edge array."""
+    return _callChunk(_worker_edges, _worker_table, *args)
+
+def _poolChunks(edges, table, tasks, processes):
+    """Yields _callChunk() results for tasks, in order, from a process pool.
     
-    df = reciprocate(df_call = df, r_prob = r_prob)
+    The edge array (and alias table) is memory-mapped read-only by every 
+    worker instead of being pickled with each task. At most two chunks per 
+    worker are in flight so finished chunks don't pile up in memory.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    tmpdir = tempfile.mkdtemp(prefix = 'cdrhelper')
+    try:
+        shared = _shareArray(edges, tmpdir, 'edges')
+        if table is not None:
+            table = (_shareArray(table[0], tmpdir, 'prob'), 
+                     _shareArray(table[1], tmpdir, 'alias'))
+        pool = multiprocessing.Pool(processes, initializer = _initChunkWorker,
+                                    initargs = (shared, table))
+        try:
+            pending = deque()
+            for task in tasks:
+                pending.append(pool.apply_async(_chunkWorker, (task,)))
+                if len(pending) >= 2 * processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+
+def generateCallChunks(G, days = 90, chunkdays = 1, callsperday = 20, 
+                       startdate = '20130101', mean_calls = 5, 
+                       call_dur = 1.15, mean_sms = 25, mean_mms = 10, 
+                       r_prob = .33, seed = None, processes = None, 
+                       activity = None):
+    """Yields call dataframes for consecutive chunks of chunkdays days.
     
-    attr = pd.DataFrame(data = G.nodes(), columns = ['A_num'])
-    attrrows = len(attr)
-    attr['postcode'] = np.random.choice(postcodes['Postal Code'], attrrows)
-    attr['gender'] = np.random.choice([femaleid, maleid], attrrows)
-    attr['age'] = np.random.choice(range(18, 106), 
-                            p = ageweight, size = attrrows)
+    Each chunk goes through generateDateCallers(), generateCallData(), and 
+    reciprocate() on its own, so peak memory depends on chunkdays and not on
+    the total number of records. Chunks come out in date order and are
+    sorted by date and A_num within the chunk.
     
-    return(G, df, attr)
+    Parameters
+    ----------
+    G : NetworkX graph (or an (E, 2) array of edges) to select edges from.
+    chunkdays : Number of days generated at a time. (default = 1)
+    seed : master random seed. Every chunk gets a seed stream spawned from it.
+    processes : if not None, chunks are generated in a pool of this many 
+        processes (0 = one per core). The chunks are identical to the ones
+        generated without a pool.
+    activity : pick edges by weight (see generateDateCallers()). The alias 
+        table is built once and shared by every chunk.
+    
+    See generateDateCallers(), generateCallData() and reciprocate() for the
+    remaining parameters.
+    """
+    edges = _edgeArray(G)
+    table = _activityTable(edges, activity, seed)
+    params = (callsperday, mean_calls, call_dur, mean_sms, mean_mms, r_prob)
+    tasks = [(chunkstart, ndays) + params + (ss, ) for chunkstart, ndays, ss 
+             in _chunkArgs(days, chunkdays, startdate, seed)]
+    if processes is None:
+        for task in tasks:
+            yield _callChunk(edges, table, *task)
+    else:
+        for df in _poolChunks(edges, table, tasks, processes):
+            yield df
+
+def streamData(postcodes, ageweight, filename, nodes = 30, edges = 10, 
+               days = 10, chunkdays = 1, callsperday = 20, 
+               startdate = "20130101", mean_calls = 5, call_dur = 1.15,
+               mean_sms = 25, mean_mms = 10, r_prob = .33, seed = None,
+               maleid = "M", femaleid = "F", processes = None,
+               backend = 'networkx', graph = None, activity = None,
+               spatial = None):
+    """Streaming makeData(). Writes the calls to filename; returns G and attr.
+    
+    Generates the call data chunkdays days at a time (see 
+    generateCallChunks()) and appends each chunk straight to filename in the
+    same format as exportCallData() (compressed if filename ends in .gz or
+    .zst). Use this when the call data won't fit in memory. Set processes 
+    to generate the chunks in a process pool; the file is the same whatever
+    the number of processes. See makeData() for backend, graph, activity 
+    and spatial.
+    
+    Example usage: 'G, attr = streamData(postcodes, ageweight, "calls.txt")'
+    """
+    graphseed, activityseed, callseed, attrseed = _spawnSeeds(seed, 4)
+    G, home = _generateGraph(nodes = nodes, edges = edges, seed = graphseed,
+                             backend = backend, graph = graph, 
+                             postcodes = postcodes, spatial = spatial)
+    
+    with RawWriter(filename) as f:
+        for df in generateCallChunks(G, days = days, chunkdays = chunkdays,
+                                     callsperday = callsperday, 
+                                     startdate = startdate, 
+                                     mean_calls = mean_calls, 
+                                     call_dur = call_dur, 
+                                     mean_sms = mean_sms, 
+                                     mean_mms = mean_mms, r_prob = r_prob, 
+                                     seed = callseed, 
+                                     processes = processes,
+                                     activity = activity):
+            exportCallData(df, filename = f)
+    
+    attr = _generateAttr(G, postcodes, ageweight, maleid, femaleid, home,
+                         seed = attrseed)
+    return(G, attr)
 
 def insertMissing(attr, seed = None, p_post = 0, p_age = 0, p_gender = 0):
     """Outputs new attributes dataframe with random missingness.
@@ -247,10 +1250,36 @@ def insertMissing(attr, seed = None, p_post = 0, p_age = 0, p_gender = 0):
 ##              change any of those columns back into integer upon export to 
 ##              make sure the data look as close to the real data as possible.
 ################################################################################
-def exportAttrData(df_attr, filename = "../data/fake1attrdata.txt"):
+def exportAttrData(df_attr, filename = "../data/fake1attrdata.txt", 
+                   engine = 'numpy', compression = 'infer', threads = None):
+    """Writes the attribute dataframe as a raw attribute file.
+    
+    engine : 'numpy' (default) formats the rows in vectorized chunks, see 
+        writeRaw(); 'python' is DataFrame.to_csv(). Same bytes either way.
+    compression : 'infer' (.gz or .zst file names), None, 'gzip' or 'zstd',
+        compressed in threads background threads (see RawWriter)
+    """
+    if engine == 'numpy':
+        writeRaw(df_attr, filename, float_format = '%.0f', 
+                 compression = compression, threads = threads)
+        return
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
     df_attr.to_csv(filename, index = False, sep = ";", float_format = '%.0f', 
-                    na_rep = " ", header = False)
+                    na_rep = " ", header = False, compression = compression)
 
-def exportCallData(df_call, filename = "../data/fake1calldata.txt"):
+def exportCallData(df_call, filename = "../data/fake1calldata.txt",
+                   engine = 'numpy', compression = 'infer', threads = None):
+    """Writes the call dataframe as a raw call file.
+    
+    filename can also be an open file or RawWriter to append to. See 
+    exportAttrData() for the other parameters.
+    """
+    if engine == 'numpy':
+        writeRaw(df_call, filename, compression = compression, 
+                 threads = threads)
+        return
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
     df_call.to_csv(filename, index = False, sep = ";", na_rep = " ", 
-                    header = False)
+                    header = False, compression = compression)
@@ -1,36 +1,317 @@
 """
 Tools to import the fake call detail records.
 
-importNodes() - line by line import using raw attribute file (networkx graph)
-importEdges() - line by line import using raw call files (networkx graph)
+importNodes() - import using raw attribute file (networkx graph)
+importNodeAttr() - import using raw attribute file (NodeAttr table)
+importEdges() - import using raw call files (networkx graph)
+importEdgeArrays() - chunked import using raw call files (edge arrays)
 importAttr() - pandas import using raw attribute file (pandas dataframe)
-importCalls() - pandas import using raw call files (pandas dataframe)
+importCalls() - pandas import using raw call files (pandas dataframe),
+    optionally parsed in parallel
+compactCalls(), compactAttr() - compact-dtype versions of those dataframes
+
+All of them take a cache option to keep a memory-mapped columnar copy of the
+raw file (see cache.py) so that later imports skip the parsing. Every raw 
+file argument can be a path (str or pathlib), a list of paths, a glob 
+pattern (str only) or an open file object, and files ending in .gz or .zst 
+are read compressed (see openRaw()). File objects are never cached.
 """
 
+import io
+import os
+import contextlib
+import glob
+import itertools
+import math
+import multiprocessing
+from collections import namedtuple
 import networkx as nx
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from cdrhelper.cache import cachedFrame
+from cdrhelper.rawfile import openRaw, _compression
+
+CALL_COLUMNS = ['date', 'A_num', 'B_num', 'calls', 'min', 'sms', 'mms']
+ATTR_COLUMNS = ['A_num', 'postcode', 'gender', 'age']
+WEIGHTS = ['calls', 'min', 'sms', 'mms']
+
+##  Compact (COO) edge list: nodes holds the node ids and row/col index into
+##  it. Sorted by (row, col); for undirected edges row <= col.
+EdgeArrays = namedtuple('EdgeArrays', ['nodes', 'row', 'col', 'calls', 'min',
+                                       'sms', 'mms', 'directed'])
+
+##  Node attribute table: one row per node, sorted by node id (see 
+##  attrRows()). Missing values are -1; male is 1, 0 or -1 (unknown).
+##  Columns: nodes (int64), post (int32), age (int16), male and agecat (int8).
+##  Numeric postcodes are stored as is; if any postcode is not a number
+##  (e.g. 'G7S'), post holds codes into the sorted strings of postcodes 
+##  (None otherwise).
+NodeAttr = namedtuple('NodeAttr', ['nodes', 'post', 'age', 'male', 'agecat',
+                                   'postcodes'])
+NodeAttr.__new__.__defaults__ = (None, )
+AGECATS = np.array([0, 20, 30, 40, 50, 60])
+##  Version stamps of the NodeAttr tables importNodes() attaches to graphs
+##  (see demographicIndex()).
+_attr_versions = itertools.count(1)
+
+def _readCalls(cfile):
+    """Parses a raw call file into a dataframe (see importCalls())."""
+    with _openInput(cfile) as f:
+        return pd.read_csv(f, sep = ';', na_values = " ", 
+                           names = CALL_COLUMNS)
 
-def importNodes(afile):
+def _readAttr(afile):
+    """Parses a raw attribute file into a dataframe (see importAttr())."""
+    with _openInput(afile) as f:
+        return pd.read_csv(f, sep = ';', na_values = " ", 
+                           names = ATTR_COLUMNS)
+
+def _openInput(path, text = False):
+    """Opens a path (plain or compressed) for reading; file objects (e.g. 
+    io.BytesIO) are passed through as they are and left open."""
+    if hasattr(path, 'read'):
+        return contextlib.nullcontext(path)
+    return openRaw(path, text = text)
+
+def _rawLines(path):
+    """Yields the lines of one or more (compressed) raw files, in order."""
+    for f in _rawFiles(path):
+        with _openInput(f, text = True) as lines:
+            for line in lines:
+                ##  Binary file objects give bytes.
+                yield line.decode() if isinstance(line, bytes) else line
+
+def _rawFrame(path, kind, cache = None, reader = None):
+    """Returns the parsed columns of a raw 'calls' or 'attr' file.
+    
+    cache : None (parse the file), True (use the default cache folder), or a
+        cache folder. See cachedFrame().
+    reader : function parsing the file (default _readCalls() or _readAttr())
+    """
+    if reader is None:
+        reader = _readCalls if kind == 'calls' else _readAttr
+    if cache is None or cache is False or hasattr(path, 'read'):
+        return reader(path)
+    return cachedFrame(path, kind, reader, cachedir = cache)
+
+def _rawFrames(path, kind, cache = None):
+    """Returns the concatenated _rawFrame()s of one or more raw files."""
+    frames = [_rawFrame(f, kind, cache) for f in _rawFiles(path)]
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index = True)
+
+##  Parallel parsing: the call files are cut into byte ranges that start and
+##  end on a line boundary, parsed by a pool of processes and put back
+##  together in file order. Compressed files can't be cut, they are parsed 
+##  whole, one per process.
+
+def _rawFiles(path):
+    """Returns the list of raw files (path: path, list of paths or glob).
+    
+    Only str paths are glob patterns; os.PathLike paths are turned into 
+    str and file objects (anything with a read method) are passed through.
+    """
+    if isinstance(path, (list, tuple)):
+        return list(path)
+    if hasattr(path, 'read'):
+        return [path]
+    path = os.fspath(path)
+    if isinstance(path, str) and any(c in path for c in '*?['):
+        files = sorted(glob.glob(path))
+        if not files:
+            raise IOError("No file matches %s" % path)
+        return files
+    return [path]
+
+def _byteRanges(path, parts):
+    """Cuts a file into (at most) parts newline-aligned byte ranges."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(i * size // parts - 1)
+            f.readline()            # move to the start of the next line
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    bounds = sorted(set(bounds))
+    return [(path, start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+def _parseRange(task):
+    """Parses the lines of a call file between two byte offsets."""
+    path, start, end = task
+    if start is None:
+        return _readCalls(path)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _readCalls(io.BytesIO(data))
+
+def _readCallsParallel(files, processes = 0, chunkbytes = 2 ** 26):
+    """Parses call files in a pool of processes (0 = one per core).
+    
+    Each file is cut into byte ranges of about chunkbytes (smaller if needed
+    to keep every process busy). The pieces are concatenated in order, so 
+    the result is the same as reading the files one after the other.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    ##  File objects can't be cut (or sent to another process): they are 
+    ##  parsed whole, here.
+    sizes = [0 if hasattr(f, 'read') else os.path.getsize(f) for f in files]
+    chunkbytes = max(1, min(chunkbytes, 
+                            int(math.ceil(sum(sizes) / float(processes)))))
+    tasks = []
+    for f, size in zip(files, sizes):
+        if hasattr(f, 'read') or _compression(f) is not None:
+            tasks.append((f, None, None))
+        elif size > 0:
+            tasks.extend(_byteRanges(f, int(math.ceil(size / 
+                                                      float(chunkbytes)))))
+    if not tasks:
+        return pd.DataFrame(columns = CALL_COLUMNS)
+    local = [hasattr(t[0], 'read') for t in tasks]
+    remote = [t for t, here in zip(tasks, local) if not here]
+    if processes == 1 or len(remote) <= 1:
+        parsed = [_parseRange(t) for t in remote]
+    else:
+        pool = multiprocessing.Pool(min(processes, len(remote)))
+        try:
+            parsed = pool.map(_parseRange, remote, chunksize = 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    parsed = iter(parsed)
+    pieces = [_parseRange(t) if here else next(parsed) 
+              for t, here in zip(tasks, local)]
+    return pd.concat(pieces, ignore_index = True)
+
+def _addNode(G, i, post, male, age):
+    """Adds node i and its attributes (plus discretized age) to G."""
+    # age discretization
+    agecat = None
+    if (age is None):
+        pass
+    elif (age < 20):
+        agecat = 0
+    elif (age >= 20) and (age < 30):
+        agecat = 20
+    elif (age >= 30) and (age < 40):
+        agecat = 30
+    elif (age >= 40) and (age < 50):
+        agecat = 40
+    elif (age >= 50) and (age < 60):
+        agecat = 50
+    elif (age >= 60):
+        agecat = 60
+
+    G.add_node(i, post = post, age = age, male = male, agecat = agecat)
+
+def ageCategory(age):
+    """Discretizes ages like importNodes(): 0 (< 20), 20, 30, 40, 50 or 60 
+    (60+). Missing ages (NaN) get -1. Returns an int8 array."""
+    age = np.asarray(age, dtype = float)
+    agecat = AGECATS[np.searchsorted(AGECATS[1:], age, side = 'right')]
+    return np.where(np.isnan(age), -1, agecat).astype(np.int8)
+
+def nodeAttrTable(df_attr):
+    """Returns the NodeAttr table of an attribute dataframe.
+    
+    Parameters:
+    -----------
+    df_attr : dataframe with the A_num, postcode, gender and age columns (raw
+        attribute file, importAttr() or makeData() output)
+    """
+    ids = np.asarray(df_attr['A_num'], dtype = np.int64)
+    ##  Sort by node id; if a node shows up twice, the last row wins (same as
+    ##  adding it twice to a graph).
+    order = np.argsort(ids, kind = 'stable')
+    last = np.ones(len(order), dtype = bool)
+    last[:-1] = ids[order][1:] != ids[order][:-1]
+    order = order[last]
+    
+    raw = pd.Series(np.asarray(df_attr['postcode'], dtype = object)[order])
+    post = pd.to_numeric(raw, errors = 'coerce')
+    postcodes = None
+    if (post.isnull() & raw.notnull()).any():
+        ##  Alphanumeric postcodes: codes into the sorted distinct strings.
+        codes, postcodes = pd.factorize(raw.where(raw.isnull(), 
+                                                  raw.astype(str)), 
+                                        sort = True)
+        post = pd.Series(codes).where(codes >= 0)
+        postcodes = np.asarray(postcodes, dtype = object)
+    age = pd.to_numeric(pd.Series(np.asarray(df_attr['age'])[order]))
+    gender = pd.Series(np.asarray(df_attr['gender'], dtype = object)[order])
+    male = np.where(gender.values == "M", 1, 0)
+    male[gender.isnull().values] = -1
+    return NodeAttr(nodes = ids[order],
+                    post = post.fillna(-1).values.astype(np.int32),
+                    age = age.fillna(-1).values.astype(np.int16),
+                    male = male.astype(np.int8),
+                    agecat = ageCategory(age.values), 
+                    postcodes = postcodes)
+
+def attrRows(A, nodes):
+    """Returns the rows of A (a NodeAttr) of the given nodes, -1 if absent."""
+    nodes = np.asarray(nodes, dtype = np.int64)
+    if len(A.nodes) == 0:
+        return np.full(len(nodes), -1, dtype = np.intp)
+    rows = np.minimum(np.searchsorted(A.nodes, nodes), len(A.nodes) - 1)
+    return np.where(A.nodes[rows] == nodes, rows, -1)
+
+def importNodeAttr(afile, cache = None):
+    """Returns the NodeAttr table of the raw attribute file.
+    
+    Parameters:
+    -----------
+    afile : path to the raw attribute file (or a list or glob pattern of 
+        them; .gz and .zst files are read compressed)
+    cache : if set (True or a cache folder), the columns are read from the 
+        columnar cache of afile (see cachedFrame()).
+    """
+    return nodeAttrTable(_rawFrames(afile, 'attr', cache))
+
+def importNodes(afile, cache = None, engine = 'numpy'):
     """Uses the attribute file to return a node-only graph object.
     
     Using raw attribute files, will create a nx.Graph() object with no edges.
-    Import is performed line-by-line (vs pandas import). This new object will
-    contain attribute information as well as a discretized version of age.
+    By default the attributes and the discretized age are kept in a NodeAttr
+    table (see importNodeAttr()) in G.graph['attr'] rather than on each 
+    node; selectNodes() and agexsexsubset() look them up there.
     
     Parameters:
     -----------
-    afile : path to attribute file
+    afile : path to attribute file (or a list or glob pattern of them; .gz 
+        and .zst files are read compressed)
+    cache : if set (True or a cache folder), the attribute file is read from 
+        its columnar cache (see cachedFrame()). numpy engine only.
+    engine : 'numpy' (default) builds the NodeAttr table. 'python' is the 
+        original line-by-line import that stores post, age, male and agecat
+        on each node.
     """
     G = nx.Graph()
     
-    for line in open(afile):
+    if engine == 'numpy':
+        df = _rawFrames(afile, 'attr', cache)
+        G.add_nodes_from(np.asarray(df['A_num'], dtype = np.int64).tolist())
+        G.graph['attr'] = nodeAttrTable(df)
+        G.graph['attrversion'] = next(_attr_versions)
+        return(G)
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
+    elif cache is not None and cache is not False:
+        raise ValueError("The cache needs engine = 'numpy'.")
+    
+    for line in _rawLines(afile):
         acolumns = line.rstrip().split(';')
         i = int(acolumns[0])
         
         post = None
         if (acolumns[1] != ' ' and acolumns[1] != ''):
-            post = int(acolumns[1]) 
+            try:
+                post = int(acolumns[1])
+            except ValueError:      # alphanumeric postcode (e.g. 'G7S')
+                post = acolumns[1]
         
         age = None
         if (acolumns[3]!=' ' and acolumns[3]!=''):
@@ -40,40 +321,39 @@ def importNodes(afile):
         if (acolumns[2]!='' and acolumns[2]!=' '):
             male = 1 if acolumns[2]=="M" else 0     # note ternary operation
         
-        # age discretization
-        if (age < 20) and (age is not None):
-            agecat = 0
-        elif (age >= 20) and (age < 30):
-            agecat = 20
-        elif (age >= 30) and (age < 40):
-            agecat = 30
-        elif (age >= 40) and (age < 50):
-            agecat = 40
-        elif (age >= 50) and (age < 60):
-            agecat = 50
-        elif (age >= 60):
-            agecat = 60
-
-        G.add_node(i, post = post, age = age, male = male, agecat = agecat)
+        _addNode(G, i, post, male, age)
 
     return(G)
 
-def importEdges(cfile, G, directed = False):
-    """Create a directed or undirected network using line-by-line import. 
+def importEdges(cfile, G, directed = False, engine = 'numpy', cache = None):
+    """Create a directed or undirected network from the raw call file. 
     
-    Using the raw call data and node-only graph, make a directed network line 
-    by line (as opposed to a pandas dataframe import).
+    Using the raw call data and node-only graph, make a directed network 
+    (as opposed to a pandas dataframe import).
     
     Parameters:
     -----------
-    cfile : path to call file
+    cfile : path to call file (or a list or glob pattern of them; .gz and 
+        .zst files are read compressed)
     G : a node-only network object generated by importNodes()
     directed : a boolean indicating if a DiGraph or a Graph should be returned.
+    engine : 'numpy' (default) sums the edges with importEdgeArrays() and adds
+        them to G in bulk. 'python' is the original line-by-line import.
+    cache : if set (True or a cache folder), the calls are read from the 
+        columnar cache of cfile (see cachedFrame()). numpy engine only.
     """
+    if engine == 'numpy':
+        return edgeArraysToGraph(importEdgeArrays(cfile, directed, 
+                                                  cache = cache), G)
+    elif engine != 'python':
+        raise ValueError("Unknown engine: %s" % engine)
+    elif cache is not None and cache is not False:
+        raise ValueError("The cache needs engine = 'numpy'.")
+    
     if (directed == True):
         G = nx.DiGraph(G)
 
-    for line in open(cfile):
+    for line in _rawLines(cfile):
         ccolumns = line.rstrip().split(';')
         # ccolumns[0] is the date
         i       = int(ccolumns[1])
@@ -92,32 +372,276 @@ def importEdges(cfile, G, directed = False):
             G.add_edge(i, j, calls = calls, min = mins, sms = sms, mms = mms)
     return G
 
-def importAttr(afile):
+def _reduceEdges(a, b, w, directed):
+    """Sums the weights (columns of w) of duplicate (a, b) edges.
+    
+    Sort-reduce: sorts by (a, b) -- (min, max) if undirected -- and sums each 
+    run of equal edges with np.add.reduceat. Returns sorted a, b, w.
+    """
+    if not directed:
+        a, b = np.minimum(a, b), np.maximum(a, b)
+    order = np.lexsort((b, a))
+    a, b, w = a[order], b[order], w[order]
+    if len(a) == 0:
+        return a, b, w
+    start = np.flatnonzero(np.r_[True, (a[1:] != a[:-1]) | (b[1:] != b[:-1])])
+    return a[start], b[start], np.add.reduceat(w, start, axis = 0)
+
+def _callChunks(cfile, chunksize, cache = None, usecols = CALL_COLUMNS[1:]):
+    """Yields the calls of one or more raw files chunksize lines at a time."""
+    for f in _rawFiles(cfile):
+        if cache is not None and cache is not False:
+            df = _rawFrame(f, 'calls', cache)[usecols]
+            for x in range(0, len(df), chunksize):
+                yield df.iloc[x:x + chunksize]
+            continue
+        with _openInput(f) as raw:
+            for chunk in pd.read_csv(raw, sep = ';', na_values = " ", 
+                                     names = CALL_COLUMNS, usecols = usecols,
+                                     chunksize = chunksize):
+                yield chunk
+
+def importEdgeArrays(cfile, directed = False, chunksize = 2000000, 
+                     cache = None):
+    """Returns the summed call, minute, SMS and MMS weights as EdgeArrays.
+    
+    Parses the raw call file in chunks of chunksize lines. Each chunk is 
+    reduced to one row per edge (sort-reduce, see _reduceEdges()) and the 
+    reduced chunks are merged the same way, so memory depends on the number
+    of distinct edges rather than the number of records. Same sums as 
+    importEdges(): undirected edges add up both directions.
+    
+    Use edgeArraysToCSR() for sparse matrices or edgeArraysToGraph() for a
+    networkx graph.
+    
+    Parameters:
+    -----------
+    cfile : path to the raw call file (or a list or glob pattern of them; 
+        .gz and .zst files are read compressed)
+    directed : a boolean indicating if (u, v) and (v, u) are different edges
+    chunksize : number of lines parsed at a time
+    cache : if set (True or a cache folder), the calls are read from the 
+        columnar cache of cfile (see cachedFrame()).
+    """
+    a, b, w = [], [], []
+    held = 0
+    for chunk in _callChunks(cfile, chunksize, cache):
+        chunk = chunk.dropna(subset = ['A_num', 'B_num'])
+        ca, cb, cw = _reduceEdges(chunk['A_num'].values.astype(np.int64),
+                                  chunk['B_num'].values.astype(np.int64),
+                                  chunk[WEIGHTS].fillna(0).values
+                                  .astype(np.float64), directed)
+        a.append(ca)
+        b.append(cb)
+        w.append(cw)
+        held += len(ca)
+        ##  Merge the reduced chunks once they get big.
+        if held > 2 * chunksize and len(a) > 1:
+            a, b, w = [[x] for x in _reduceEdges(np.concatenate(a), 
+                       np.concatenate(b), np.concatenate(w), directed)]
+            held = len(a[0])
+    if len(a):
+        a, b, w = _reduceEdges(np.concatenate(a), np.concatenate(b), 
+                               np.concatenate(w), directed)
+    else:
+        a, b, w = np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, 4))
+    
+    nodes = np.unique(np.concatenate((a, b)))
+    idtype = np.int32 if len(nodes) < 2 ** 31 else np.int64
+    return EdgeArrays(nodes = nodes, 
+                      row = np.searchsorted(nodes, a).astype(idtype),
+                      col = np.searchsorted(nodes, b).astype(idtype),
+                      calls = w[:, 0].astype(np.int64), min = w[:, 1],
+                      sms = w[:, 2].astype(np.int64), 
+                      mms = w[:, 3].astype(np.int64), directed = directed)
+
+def edgeArraysToCSR(E, weight = 'calls'):
+    """Returns an EdgeArrays weight as a (nodes x nodes) scipy CSR matrix.
+    
+    Rows and columns follow E.nodes. Undirected edges are stored in both 
+    directions (symmetric matrix). weight = None gives 1 for every edge.
+    """
+    n = len(E.nodes)
+    data = np.ones(len(E.row)) if weight is None else getattr(E, weight)
+    row, col = E.row, E.col
+    if not E.directed:
+        loop = row == col
+        row, col = np.r_[row, col[~loop]], np.r_[col, row[~loop]]
+        data = np.r_[data, data[~loop]]
+    return sp.csr_matrix((data, (row, col)), shape = (n, n))
+
+def edgeArraysToGraph(E, G = None):
+    """Returns a networkx Graph (or DiGraph if E is directed) from EdgeArrays.
+    
+    Edges get the same 'calls', 'min', 'sms' and 'mms' attributes as with 
+    importEdges() and are added in bulk. If G (e.g. from importNodes()) is 
+    given, its nodes and attributes are kept and weights of edges already in
+    G are added to.
+    """
+    H = nx.DiGraph() if E.directed else nx.Graph()
+    if G is not None:
+        H = nx.DiGraph(G) if E.directed else G
+    u = E.nodes[E.row].tolist()
+    v = E.nodes[E.col].tolist()
+    weights = zip(E.calls.tolist(), E.min.tolist(), E.sms.tolist(), 
+                  E.mms.tolist())
+    if H.number_of_edges() == 0:
+        H.add_edges_from((i, j, {'calls': c, 'min': m, 'sms': s, 'mms': x})
+                         for i, j, (c, m, s, x) in zip(u, v, weights))
+        return H
+    for i, j, (c, m, s, x) in zip(u, v, weights):
+        if H.has_edge(i, j):
+            H[i][j]['calls'] += c
+            H[i][j]['min']   += m
+            H[i][j]['sms']   += s
+            H[i][j]['mms']   += x
+        else:
+            H.add_edge(i, j, calls = c, min = m, sms = s, mms = x)
+    return H
+
+##  Compact schema: the smallest integer type that holds each column (ids,
+##  counters), float32 minutes, dates as int16 day offsets from a base date 
+##  and categoricals for the string-like columns. Columns with missing values
+##  get the pandas nullable version of their type (e.g. 'UInt16').
+
+def _compactInt(x, dtypes):
+    """Returns x as the first of dtypes that holds all of its values."""
+    x = pd.to_numeric(x)
+    if len(x) == 0 or x.isnull().all():
+        lo = hi = 0
+    else:
+        lo, hi = x.min(), x.max()
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            break
+    if x.isnull().any():
+        return x.astype(dtype.capitalize().replace('Uint', 'UInt'))
+    return x.astype(dtype)
+
+def dayOffsets(date, basedate = None):
+    """Returns the YYYYMMDD dates as int16 day offsets from basedate.
+    
+    basedate defaults to the earliest date. Returns (offsets, basedate) with
+    basedate as a 'YYYYMMDD' string.
+    """
+    date = pd.to_numeric(pd.Series(date))
+    missing = date.isnull().values
+    uniques, inverse = np.unique(date.values[~missing].astype(np.int64), 
+                                 return_inverse = True)
+    days = pd.to_datetime(pd.Series(uniques.astype(str)), format = '%Y%m%d')
+    if basedate is None:
+        base = days.min() if len(days) else pd.Timestamp('19700101')
+    else:
+        base = pd.Timestamp(str(basedate))
+    offsets = np.zeros(len(date), dtype = np.int64)
+    offsets[~missing] = ((days - base).dt.days.values)[inverse]
+    offsets = pd.Series(offsets, index = date.index)
+    offsets[missing] = np.nan
+    return _compactInt(offsets, ['int16', 'int32']), base.strftime('%Y%m%d')
+
+def compactCalls(df_call, basedate = None):
+    """Returns the call dataframe with the compact schema.
+    
+    The date becomes an int16 day offset from basedate (default: the first 
+    date), stored in df.attrs['basedate']. A_num and B_num are int32, calls,
+    sms and mms uint16 (uint32 if needed) and min float32.
+    
+    Parameters:
+    -----------
+    df_call : a dataframe from importCalls() (or makeData())
+    basedate : the 'YYYYMMDD' date of day 0
+    """
+    df = df_call.copy(deep = False)
+    df['date'], basedate = dayOffsets(df['date'], basedate)
+    for col in ['A_num', 'B_num']:
+        df[col] = _compactInt(df[col], ['int32', 'int64'])
+    for col in ['calls', 'sms', 'mms']:
+        df[col] = _compactInt(df[col], ['uint16', 'uint32', 'uint64'])
+    df['min'] = df['min'].astype(np.float32)
+    df.attrs['basedate'] = basedate
+    return(df)
+
+def compactAttr(df_attr):
+    """Returns the attribute dataframe with the compact schema.
+    
+    A_num is int32, age uint8 and postcode and gender are categoricals. 
+    
+    Parameters:
+    -----------
+    df_attr : a dataframe from importAttr() (or makeData())
+    """
+    df = df_attr.copy(deep = False)
+    df['A_num'] = _compactInt(df['A_num'], ['int32', 'int64'])
+    df['age'] = _compactInt(df['age'], ['uint8', 'uint16'])
+    if pd.api.types.is_float_dtype(df['postcode']):
+        ##  Numeric postcodes read as floats because of missing values.
+        df['postcode'] = _compactInt(df['postcode'], ['int32', 'int64'])
+    for col in ['postcode', 'gender']:
+        df[col] = df[col].astype('category')
+    return(df)
+
+def importAttr(afile, cache = None, compact = False):
     """Returns a pandas dataframe of the raw attribute file. 
     
     NOTE: Also categorizes age (in same way as line-by-line import).
     
     Parameters:
     -----------
-    afile : path to the raw attribute file
+    afile : path to the raw attribute file (or a list or glob pattern of 
+        them; .gz and .zst files are read compressed)
+    cache : if set (True or a cache folder), the columns are memory-mapped 
+        from the columnar cache of afile (see cachedFrame()).
+    compact : if True, use the compact schema (see compactAttr())
     """
-    df_attr = pd.read_csv(afile, sep = ';', na_values = " ", 
-            names = ['A_num', 'postcode', 'gender', 'age'])
+    df_attr = _rawFrames(afile, 'attr', cache)
     ##  Discretize age into categories in the attribute file.
     df_attr['agecat'] = pd.cut(df_attr.age, [0, 20, 30, 40, 50, 60, np.inf], 
                         right = False, 
                         labels=[0, 20, 30, 40, 50, 60])
+    if compact:
+        df_attr = compactAttr(df_attr)
     df_attr.index = df_attr.A_num
     return(df_attr)
 
-def importCalls(cfile):
+def importCalls(cfile, cache = None, processes = None, chunkbytes = 2 ** 26,
+                compact = False, basedate = None):
     """Imports the call data. Returns it as a pandas dataframe.
     
     Parameters:
     -----------
-    cfile : path to the raw call file
+    cfile : path to the raw call file, or a list or glob pattern of call files
+        (e.g. daily files) that are concatenated in (sorted) order. Files 
+        ending in .gz or .zst are inflated in a worker thread while parsing.
+        pathlib paths and open file objects work too (file objects are never
+        cached or cut).
+    cache : if set (True or a cache folder), the columns are memory-mapped 
+        from the columnar cache of each file (see cachedFrame()).
+    processes : if not None, the files are cut into newline-aligned byte 
+        ranges that are parsed in a pool of this many processes (0 = one per
+        core); compressed files are parsed whole, one per process. The 
+        result is the same as with a single process.
+    chunkbytes : approximate size of the byte ranges
+    compact : if True, use the compact schema (see compactCalls()): about a 
+        third of the memory, and faster groupbys.
+    basedate : the 'YYYYMMDD' date of day 0 for the compact schema (default:
+        the first date)
     """
-    df_call = pd.read_csv(cfile, sep = ';', na_values = " ",
-            names = ['date', 'A_num', 'B_num', 'calls', 'min', 'sms', 'mms'])
+    files = _rawFiles(cfile)
+    if processes is None:
+        frames = [_rawFrame(f, 'calls', cache) for f in files]
+    elif cache is None or cache is False:
+        frames = [_readCallsParallel(files, processes, chunkbytes)]
+    else:
+        frames = [_rawFrame(f, 'calls', cache, 
+                            reader = lambda x: _readCallsParallel(
+                                [x], processes, chunkbytes)) 
+                  for f in files]
+    if len(frames) == 1:
+        df_call = frames[0]
+    else:
+        df_call = pd.concat(frames, ignore_index = True)
+    if compact:
+        df_call = compactCalls(df_call, basedate)
     return(df_call)
 
@@ -2,31 +2,153 @@
 Miscellaneous tools I use to analyze the European CDR data.
 """
 import os
+import shutil
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from cdrhelper.importer import dayOffsets, attrRows, WEIGHTS
+from cdrhelper.importer import AGECATS
+from cdrhelper.importer import _callChunks, _reduceEdges
 
 def folderCheck(folder):
     """Check if a folder exists -- if not, create it."""
     if not os.path.isdir(folder):
         os.makedirs(folder)
 
+##  Sharing arrays with worker processes
+def _shareArray(arr, folder, name):
+    """Saves arr to folder so worker processes can memory-map it read-only.
+    
+    Returns the .npy path to hand to the workers (see _loadShared()). Object
+    arrays can't be memory-mapped, so those are returned as is and get 
+    pickled to each worker instead.
+    """
+    arr = np.asarray(arr)
+    if arr.dtype.hasobject:
+        return arr
+    path = os.path.join(folder, name + '.npy')
+    np.save(path, arr)
+    return path
+
+def _loadShared(ref):
+    """Opens an array shared by _shareArray() (read-only memory map)."""
+    if isinstance(ref, np.ndarray):
+        return ref
+    return np.load(ref, mmap_mode = 'r')
+
 ##  Subsetting nodes by gender and age
+##  The demographic index groups the nodes of G by (agecat, male) bucket in
+##  one pass; missing values (None, -1 or no attributes at all) are buckets
+##  of their own. Buckets are ordered agecat first, so an age category is a
+##  single slice. Within a bucket nodes keep their graph order.
+AGE_BUCKETS = [0, 20, 30, 40, 50, 60, None]
+MALE_BUCKETS = [0, 1, None]
+
+def _nodeBuckets(G):
+    """Returns the nodes of G and their agecat and male values (-1 missing).
+    
+    Attributes come from the NodeAttr table in G.graph['attr'] if there is 
+    one, else from the node dicts.
+    """
+    A = G.graph.get('attr')
+    nodes = np.asarray(list(G))
+    if A is not None:
+        rows = attrRows(A, nodes)
+        agecat = np.where(rows >= 0, A.agecat[rows], -1)
+        male = np.where(rows >= 0, A.male[rows], -1)
+    else:
+        data = G.nodes(data = True)
+        agecat = np.array([-1 if d.get('agecat') is None else d['agecat'] 
+                           for n, d in data], dtype = np.int64)
+        male = np.array([-1 if d.get('male') is None else d['male'] 
+                         for n, d in data], dtype = np.int64)
+    return nodes, agecat.astype(np.int64), male.astype(np.int64)
+
+def _indexStamp(G):
+    """What has to stay the same for a cached demographic index to be used:
+    the number of nodes, the NodeAttr table (the object itself, kept alive 
+    by the cache so its id can't be reused) and its version (bumped by 
+    importNodes()). O(1)."""
+    A = G.graph.get('attr')
+    return (G.number_of_nodes(), id(A), G.graph.get('attrversion'))
+
+def demographicIndex(G, refresh = False):
+    """Returns the (agecat, male) index of the nodes of G, cached in G.graph.
+    
+    The index is (nodes, order, bounds): the nodes of G, their positions 
+    grouped by bucket (graph order within a bucket) and the start of each
+    bucket (see AGE_BUCKETS and MALE_BUCKETS). Attributes come from the 
+    NodeAttr table in G.graph['attr'] if there is one (see importNodes()),
+    else from the node dicts.
+    
+    The cache is checked in constant time (see _indexStamp()): it is 
+    rebuilt when the number of nodes or the NodeAttr table changes. Call 
+    clearDemographicIndex(G) (or pass refresh = True) after editing node 
+    attributes (node dicts or NodeAttr arrays) in place or after replacing
+    nodes without changing their number.
+    """
+    stamp = _indexStamp(G)
+    cached = G.graph.get('demographics')
+    if (not refresh) and (cached is not None) and (cached[0] == stamp):
+        return cached[2]
+    
+    nodes, agecat, male = _nodeBuckets(G)
+    ##  Bucket codes; anything unknown goes to the missing bucket.
+    agecode = np.searchsorted(AGECATS, agecat)
+    agecode[(agecode >= len(AGECATS)) | 
+            (AGECATS[np.minimum(agecode, len(AGECATS) - 1)] != agecat)] = \
+        len(AGECATS)
+    malecode = np.where((male == 0) | (male == 1), male, 2)
+    bucket = agecode * len(MALE_BUCKETS) + malecode
+    order = np.argsort(bucket, kind = 'stable')
+    bounds = np.searchsorted(bucket[order], 
+                             np.arange(len(AGE_BUCKETS) * len(MALE_BUCKETS) 
+                                       + 1))
+    G.graph['demographics'] = (stamp, G.graph.get('attr'), 
+                               (nodes, order, bounds))
+    return nodes, order, bounds
+
+def clearDemographicIndex(G):
+    """Drops the cached demographic index of G (see demographicIndex()).
+    
+    Needed after editing node attributes in place, e.g. 
+    G.nodes[n]['male'] = 0, which the cache can't see.
+    """
+    G.graph.pop('demographics', None)
+
 def selectNodes(G, age = 99, male = 0):
     """Returns a list comprised of a subset of nodes specified by age
-        and sex. 99 for age or male returns all categories. 
+        and sex. 99 for age or male returns all categories. None selects
+        the nodes where the value is missing.
         
-        NOTE: Right now, I have very bad missing data handling. 
-        Ignores missingness for 99s."""
-    if (age is 99) and (male is not 99):
-        subl = [n for n in G if (G.node[n]['male'] == male)]
-    elif (male is 99) and (age is not 99):
-        subl = [n for n in G if (G.node[n]['agecat'] == age)]
-    elif (age is not 99) and (male is not 99):
-        subl = [n for n in G if (G.node[n]['agecat'] == age) and 
-                                (G.node[n]['male'] == male)]
-    elif (age is 99) and (male is 99):
-        subl = G.nodes()
-    else: 
+        Answered from the cached demographic index of G (see 
+        demographicIndex()) in time proportional to the result; nodes come
+        in graph order. Call clearDemographicIndex(G) after editing node 
+        attributes in place."""
+    if (age == 99) and (male == 99):
+        return(G.nodes())
+    if (age not in AGE_BUCKETS + [99]) or (male not in MALE_BUCKETS + [99]):
         raise NameError("Invalid subset specification.")
-    return(subl)
+    return _indexSubset(G, demographicIndex(G), age, male)
+
+def _indexSubset(G, index, age, male):
+    """Returns the nodes of a demographic index in an age x sex subset, in
+    graph order. Nodes no longer in G are left out."""
+    nodes, order, bounds = index
+    k = len(MALE_BUCKETS)
+    ages = range(len(AGE_BUCKETS)) if age == 99 else [AGE_BUCKETS.index(age)]
+    if male == 99:
+        ##  All the buckets of an age category are next to each other.
+        slices = [(bounds[a * k], bounds[a * k + k]) for a in ages]
+    else:
+        m = MALE_BUCKETS.index(male)
+        slices = [(bounds[a * k + m], bounds[a * k + m + 1]) for a in ages]
+    pos = np.concatenate([order[lo:hi] for lo, hi in slices])
+    if (age == 99) or (male == 99):
+        ##  More than one bucket: back to graph order.
+        pos = np.sort(pos)
+    return([n for n in nodes[pos].tolist() if n in G])
 
 def agexsexsubset(G):
     """Creates a list of lists of nodes by age and sex.
@@ -47,24 +169,150 @@ def agexsexsubset(G):
         agexsexnodes[20] = all females
     """
     agelist = [0, 20, 30, 40, 50, 60, 99]
-    agexsexnodes = [selectNodes(G, age = x, male = y) for y in [99, 1, 0] \
+    index = demographicIndex(G)
+    agexsexnodes = [G.nodes() if (x == 99 and y == 99) else 
+                    _indexSubset(G, index, x, y) for y in [99, 1, 0] 
                     for x in agelist]
     return(agexsexnodes)
 
-def aggregateCalls(df_call):
+def _dayNumbers(df_call):
+    """Returns the dates of df_call as day numbers (-1 if missing), the base
+    date of day 0 (None for compact frames, see compactCalls(), whose dates
+    already are day numbers) and a function giving the label of a day number
+    (YYYYMMDD, or the day number itself for compact frames)."""
+    if 'basedate' in df_call.attrs:
+        days, base = pd.to_numeric(df_call['date']), None
+        label = lambda d: int(d)
+    else:
+        days, base = dayOffsets(df_call['date'])
+        first = pd.Timestamp(base)
+        label = lambda d: int((first + pd.Timedelta(days = int(d)))
+                              .strftime('%Y%m%d'))
+    return days.fillna(-1).values.astype(np.int64), base, label
+
+def _weightColumns(df_call):
+    """Returns the summed columns of df_call as int64/float64 arrays."""
+    cols = [c for c in df_call.columns if c not in ['date', 'A_num', 'B_num']]
+    arrays = []
+    for c in cols:
+        x = pd.to_numeric(df_call[c]).fillna(0)
+        kind = np.float64 if pd.api.types.is_float_dtype(x) else np.int64
+        arrays.append(np.asarray(x, dtype = kind))
+    return cols, arrays
+
+def _windowFrame(parts, cols):
+    """Builds the aggregateCalls() output from (window, a, b, sums) parts."""
+    columns = ['window', 'A_num', 'B_num'] + ['s' + c for c in cols]
+    if not parts:
+        return pd.DataFrame(columns = columns)
+    data = [np.concatenate([p[i] for p in parts]) for i in range(3)]
+    data += [np.concatenate([p[3][j] for p in parts]) 
+             for j in range(len(cols))]
+    return pd.DataFrame(dict(zip(columns, data)), columns = columns)
+
+def _binnedCalls(key, a, b, w):
+    """Sums the weights of each (key, a, b) in one sorted pass."""
+    order = np.lexsort((b, a, key))
+    key, a, b = key[order], a[order], b[order]
+    if len(key) == 0:
+        return key, a, b, [x[order] for x in w]
+    start = np.flatnonzero(np.r_[True, (key[1:] != key[:-1]) | 
+                                 (a[1:] != a[:-1]) | (b[1:] != b[:-1])])
+    return (key[start], a[start], b[start], 
+            [np.add.reduceat(x[order], start) for x in w])
+
+def _rollingCalls(day, a, b, w, window, step, label):
+    """Yields the edge sums of each rolling window of days.
+    
+    The per-day edge sums are added to running totals when a day enters the
+    window and taken out when it leaves, so each step only touches the days
+    that changed.
+    """
+    ##  Edge ids in (a, b) order.
+    order = np.lexsort((b, a))
+    new = np.r_[True, (a[order][1:] != a[order][:-1]) | 
+                      (b[order][1:] != b[order][:-1])]
+    edge = np.empty(len(a), dtype = np.intp)
+    edge[order] = np.cumsum(new) - 1
+    ea, eb = a[order][new], b[order][new]
+    
+    acc = [np.zeros(len(ea), dtype = x.dtype) for x in w]
+    count = np.zeros(len(ea), dtype = np.int64)
+    first, last = day[0], day[-1]
+    starts = np.arange(first, max(last - window + 2, first + 1), step)
+    lo = hi = first
+    for s in starts:
+        ##  Days leaving the window, then days entering it.
+        for d0, d1, sign in [(lo, min(s, hi), -1), (max(hi, s), s + window, 1)]:
+            r0, r1 = np.searchsorted(day, [d0, d1])
+            if r1 <= r0:
+                continue
+            e = edge[r0:r1]
+            np.add.at(count, e, sign)
+            for x, total in zip(w, acc):
+                np.add.at(total, e, sign * x[r0:r1])
+            if sign < 0:
+                ##  No rounding leftovers for edges that left the window.
+                gone = e[count[e] == 0]
+                for total in acc:
+                    total[gone] = 0
+        lo, hi = s, s + window
+        live = np.flatnonzero(count > 0)
+        yield (np.full(len(live), label(s), dtype = np.int64), ea[live], 
+               eb[live], [total[live] for total in acc])
+
+def aggregateCalls(df_call, window = None, bins = None, rolling = False, 
+                   step = 1):
     """Returns an aggregated version of importCalls() dataframe.
     
+    Without window or bins, the calls are summed over the whole period. 
+    Otherwise they are summed per window of days in one sorted pass, and 
+    the result has a 'window' column with the first day of each window 
+    (YYYYMMDD, or a day offset for compact frames). Sorted by window, A_num
+    and B_num.
+    
     Parameters:
     df_call : a pandas dataframe created by the importCalls() function.
+    window : number of days per window (e.g. 7 for weekly networks), 
+        starting on the first date.
+    bins : list of dates (same format as the date column) where windows 
+        start; the last one ends the last window. Calls outside are dropped.
+    rolling : if True, windows of window days start every step days 
+        (instead of back to back). The sums are updated as days enter and 
+        leave the window rather than recomputed.
+    step : days between the starts of rolling windows.
     """
+    if (window is not None) or (bins is not None):
+        days, base, label = _dayNumbers(df_call)
+        a = np.asarray(df_call['A_num'], dtype = np.int64)
+        b = np.asarray(df_call['B_num'], dtype = np.int64)
+        cols, w = _weightColumns(df_call)
+        keep = days >= 0
+        days, a, b, w = days[keep], a[keep], b[keep], [x[keep] for x in w]
+        if len(days) == 0:
+            return _windowFrame([], cols)
+        if rolling:
+            if window is None:
+                raise ValueError("Rolling windows need a window size.")
+            day, a, b, w = _binnedCalls(days, a, b, w)
+            return _windowFrame(list(_rollingCalls(day, a, b, w, window, 
+                                                   step, label)), cols)
+        if bins is None:
+            edges = np.arange(days.min(), days.max() + window + 1, window)
+        elif base is None:
+            edges = np.asarray(bins, dtype = np.int64)
+        else:
+            edges = np.asarray(dayOffsets(bins, base)[0], dtype = np.int64)
+        binid = np.searchsorted(edges, days, side = 'right') - 1
+        keep = (binid >= 0) & (binid < len(edges) - 1)
+        k, a, b, w = _binnedCalls(binid[keep], a[keep], b[keep], 
+                                  [x[keep] for x in w])
+        starts = np.array([label(d) for d in edges[:-1]], dtype = np.int64)
+        return _windowFrame([(starts[k], a, b, w)], cols)
+
     df_sum = df_call.groupby(['A_num', 'B_num']).sum().add_prefix('s')
     df_sum = df_sum.reset_index()
     df_sum.drop('sdate', axis = 1, inplace = True)
-    ##  NOTE!
-    ##  Eventually, we want to make this generalized so that you can specify 
-    ##  the number of days you want to collapse over and then it will redo all
-    ##  these next steps for each date range.
-
     ##  Sum up the edges with weights (and obviously direction).
     ##  To be clear: .groupby will group the edges (still dircted). Then .sum
     ##  aggregates them by summing. And .add_prefix just changes column
@@ -72,3 +320,99 @@ def aggregateCalls(df_call):
     ##  renumbers the rows into an array more compatible with networkx.
     return(df_sum)
 
+##  Out-of-core aggregation: the call file is read in chunks, each chunk is 
+##  summed per edge and its rows are spilled to one of several partition 
+##  files on disk by a hash of the caller. Every edge then lives in a single
+##  partition, so the partitions can be summed one at a time (or in a pool).
+SPILL_DTYPE = np.dtype([('A_num', np.int64), ('B_num', np.int64)] + 
+                       [(c, np.float64) for c in WEIGHTS])
+
+def _partitionOf(a, partitions):
+    """Returns the partition of each caller (multiplicative hash)."""
+    h = a.astype(np.uint64) * np.uint64(11400714819323198485)
+    return ((h >> np.uint64(32)) % np.uint64(partitions)).astype(np.intp)
+
+def _spillChunk(chunk, files):
+    """Sums a chunk of calls per edge and appends it to the partition files.
+    
+    Returns, per weight, whether the chunk had non-integer values."""
+    chunk = chunk.dropna(subset = ['A_num', 'B_num'])
+    a, b, w = _reduceEdges(chunk['A_num'].values.astype(np.int64),
+                           chunk['B_num'].values.astype(np.int64),
+                           chunk[WEIGHTS].fillna(0).values
+                           .astype(np.float64), True)
+    rec = np.empty(len(a), dtype = SPILL_DTYPE)
+    rec['A_num'], rec['B_num'] = a, b
+    for i, c in enumerate(WEIGHTS):
+        rec[c] = w[:, i]
+    part = _partitionOf(a, len(files))
+    order = np.argsort(part, kind = 'stable')
+    bounds = np.searchsorted(part[order], np.arange(len(files) + 1))
+    for i, f in enumerate(files):
+        if bounds[i + 1] > bounds[i]:
+            rec[order[bounds[i]:bounds[i + 1]]].tofile(f)
+    return [pd.api.types.is_float_dtype(chunk[c]) for c in WEIGHTS]
+
+def _reducePartition(path):
+    """Sums the spilled rows of one partition file per edge."""
+    rec = np.fromfile(path, dtype = SPILL_DTYPE)
+    w = np.column_stack([rec[c] for c in WEIGHTS])
+    return _reduceEdges(rec['A_num'], rec['B_num'], w, True)
+
+def aggregateCallFile(cfile, partitions = 16, chunksize = 2000000, 
+                      processes = None, tmpdir = None):
+    """Returns the same sums as aggregateCalls(importCalls(cfile)) without 
+    loading the call file in memory.
+    
+    The file is streamed in chunks of chunksize lines. Each chunk is summed 
+    per edge and hash-partitioned by caller into spill files in a temporary
+    folder, then each partition is summed on its own. Memory depends on the
+    chunk size and the number of distinct edges per partition, not on the 
+    size of the file.
+    
+    Parameters:
+    cfile : path to the raw call file, or a list or glob of call files (.gz
+        and .zst files are read compressed)
+    partitions : number of spill files
+    chunksize : number of lines parsed at a time
+    processes : if not None, the partitions are summed in a pool of this 
+        many processes (0 = one per core)
+    tmpdir : folder for the spill files (default: the system temp folder)
+    """
+    folder = tempfile.mkdtemp(prefix = 'cdrspill', dir = tmpdir)
+    try:
+        paths = [os.path.join(folder, 'part%d.bin' % i) 
+                 for i in range(partitions)]
+        files = [open(x, 'wb') for x in paths]
+        isfloat = [False] * len(WEIGHTS)
+        try:
+            for chunk in _callChunks(cfile, chunksize):
+                isfloat = [x or y for x, y in 
+                           zip(isfloat, _spillChunk(chunk, files))]
+        finally:
+            for f in files:
+                f.close()
+        
+        if processes is None:
+            parts = [_reducePartition(x) for x in paths]
+        else:
+            pool = multiprocessing.Pool(processes or 
+                                        multiprocessing.cpu_count())
+            try:
+                parts = pool.map(_reducePartition, paths, chunksize = 1)
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        shutil.rmtree(folder, ignore_errors = True)
+    
+    a = np.concatenate([x[0] for x in parts])
+    b = np.concatenate([x[1] for x in parts])
+    w = np.concatenate([x[2] for x in parts])
+    ##  Same row order as the groupby of aggregateCalls().
+    order = np.lexsort((b, a))
+    df_sum = pd.DataFrame({'A_num': a[order], 'B_num': b[order]})
+    for i, c in enumerate(WEIGHTS):
+        df_sum['s' + c] = w[order, i] if isfloat[i] else \
+                          w[order, i].astype(np.int64)
+    return(df_sum)
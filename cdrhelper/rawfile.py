@@ -0,0 +1,462 @@
+"""
+Fast writing (and compressed reading) of the raw ';' separated call and 
+attribute files.
+
+Rows are formatted a chunk at a time with numpy: every column becomes a
+fixed-width block of bytes (digits of integers are computed arithmetically,
+strings and categories are formatted once per distinct value) and the
+blocks are glued into lines by one boolean gather. The text is written in
+large blocks; gzip blocks are compressed in a thread pool (zlib releases
+the GIL) and zstd uses the library's own worker threads.
+
+The output is byte for byte what DataFrame.to_csv(sep = ';', na_rep = " ",
+header = False, index = False) writes, with or without float_format =
+'%.0f' (NaN-holding integer columns come out as integers).
+
+Compressed files are read through openRaw(): a worker thread inflates the
+file a block at a time ahead of the reader, so that inflating and parsing 
+overlap.
+
+writeRaw() - writes a dataframe as a raw file (or to an open RawWriter)
+RawWriter - buffered, optionally compressed, output file
+openRaw() - opens a raw file (plain, .gz or .zst) for buffered reading
+"""
+
+import io
+import os
+import gzip
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+##  File name endings of the supported compressions.
+COMPRESSIONS = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd'}
+##  Default cap on the compression threads of a RawWriter (each can hold 
+##  two blocks in flight).
+MAX_THREADS = 4
+
+def _compression(filename, compression = 'infer'):
+    """Returns None, 'gzip' or 'zstd' for a file (infer: from its name)."""
+    if compression == 'infer':
+        if isinstance(filename, os.PathLike):
+            filename = os.fspath(filename)
+        if not isinstance(filename, str):
+            return None
+        for end, name in COMPRESSIONS.items():
+            if filename.lower().endswith(end):
+                return name
+        return None
+    if compression not in [None, 'gzip', 'zstd']:
+        raise ValueError("Unknown compression: %s" % compression)
+    return compression
+
+def _zstd():
+    """Returns the (optional) zstandard module."""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package")
+    return zstandard
+
+################################################################################
+##  Column formatting
+##      Every column of a chunk becomes cells = (B, first, end): an (n, w)
+##      uint8 array and, per row, the slice [first, end) of it holding the
+##      text of the cell.
+################################################################################
+SPACE, MINUS, POINT, ZERO = ord(' '), ord('-'), ord('.'), ord('0')
+
+def _digits(a, width = None):
+    """Returns the right-aligned decimal digits of uint64 a and their count."""
+    nd = np.ones(len(a), dtype = np.int64)
+    for k in range(1, 20):
+        more = a >= np.uint64(10 ** k)
+        if not more.any():
+            break
+        nd += more
+    w = int(nd.max(initial = 1)) if width is None else width
+    B = np.empty((len(a), w), dtype = np.uint8)
+    y = a.copy()
+    for k in range(w - 1, -1, -1):
+        B[:, k] = y % np.uint64(10) + ZERO
+        y //= np.uint64(10)
+    return B, nd
+
+def _signCells(B, first, neg):
+    """Puts a minus sign in front of the negative rows (first moves left)."""
+    if neg is not None and neg.any():
+        rows = np.flatnonzero(neg)
+        first[rows] -= 1
+        B[rows, first[rows]] = MINUS
+    return first
+
+def _blankCells(cells, missing):
+    """Turns the missing rows of cells into na_rep (a single space)."""
+    B, first, end = cells
+    if missing is not None and missing.any():
+        B[missing, 0] = SPACE
+        first[missing] = 0
+        end[missing] = 1
+    return cells
+
+def _intCells(a, neg = None, missing = None):
+    """Cells of integers given as magnitudes a (uint64) and signs neg."""
+    B, nd = _digits(a)
+    B = np.hstack((np.zeros((len(a), 1), dtype = np.uint8), B))
+    first = _signCells(B, B.shape[1] - nd, neg)
+    end = np.full(len(a), B.shape[1], dtype = np.int64)
+    return _blankCells((B, first, end), missing)
+
+def _signed(x):
+    """Returns the magnitudes (uint64) and signs of an integer array."""
+    if x.dtype.kind == 'u':
+        return x.astype(np.uint64), None
+    x = x.astype(np.int64)
+    neg = x < 0
+    a = x.view(np.uint64).copy()
+    a[neg] = (~a[neg]) + np.uint64(1)       # also right for the minimum
+    return a, neg
+
+def _decimalCells(x, missing, places = 6):
+    """Cells of float64 x as repr() writes them, or None if not possible.
+
+    Works when every value is a decimal with at most places decimals and 15
+    significant digits (then the shortest repr is that decimal) and is 0 or
+    at least 1e-4 (no exponent notation).
+    """
+    ok = ~missing
+    a = np.abs(x[ok])
+    if (~np.isfinite(a)).any() or ((a != 0) & (a < 1e-4)).any():
+        return None
+    for d in range(1, places + 1):
+        k = np.rint(a * 10. ** d)
+        if (k < 1e15).all() and (k / 10. ** d == a).all():
+            break
+    else:
+        return None
+    n = len(x)
+    k = np.zeros(n, dtype = np.uint64)
+    k[ok] = np.rint(a * 10. ** d).astype(np.uint64)
+    scale = np.uint64(10 ** d)
+    ip, frac = k // scale, k % scale
+    I, nd = _digits(ip)
+    F = _digits(frac, width = d)[0]
+    ##  Keep the fraction up to its last non-zero digit (at least one).
+    tz = np.zeros(n, dtype = np.int64)
+    for j in range(1, d):
+        tz += frac % np.uint64(10 ** j) == 0
+    B = np.hstack((np.zeros((n, 1), dtype = np.uint8), I,
+                   np.full((n, 1), POINT, dtype = np.uint8), F))
+    wi = I.shape[1] + 1
+    first = _signCells(B, wi - nd, np.signbit(x) & ok)
+    return _blankCells((B, first, wi + 1 + d - tz), missing)
+
+def _csvCells(x, float_format = None):
+    """Cells of a column formatted by pandas itself (the exact fallback)."""
+    text = x.to_csv(None, index = False, header = False, sep = ';',
+                    na_rep = " ", float_format = float_format,
+                    lineterminator = '\n')
+    lines = text.encode('utf-8').split(b'\n')[:-1]
+    if len(lines) != len(x):    # a quoted string spanning lines
+        raise ValueError("Column %s has line breaks" % x.name)
+    S = np.array(lines, dtype = bytes) if lines else np.zeros(0, 'S1')
+    S = S.astype('S%d' % max(S.dtype.itemsize, 1))
+    B = S.view(np.uint8).reshape(len(S), S.dtype.itemsize)
+    end = np.char.str_len(S).astype(np.int64)
+    return (B, np.zeros(len(S), dtype = np.int64), end)
+
+def _codeCells(codes, uniques, float_format = None, alone = False):
+    """Cells of a column given as codes into uniques (-1 is missing).
+    
+    The uniques are formatted as a column of their own, where the csv 
+    writer quotes empty strings (a line with a single empty field); in a 
+    row of several fields they are written empty, unless the column is 
+    alone in its frame.
+    """
+    B, first, end = _csvCells(pd.Series(uniques, dtype = object), 
+                              float_format)
+    if not alone:
+        empty = np.array([isinstance(x, str) and x == '' for x in uniques],
+                         dtype = bool)
+        end[empty] = 0
+    missing = codes < 0
+    take = np.where(missing, 0, codes)
+    if len(B) == 0:
+        B = np.zeros((1, 1), dtype = np.uint8)
+        first, end = np.zeros(1, np.int64), np.zeros(1, np.int64)
+    return _blankCells((B[take], first[take], end[take]), missing)
+
+def _columnCells(x, float_format = None, alone = False):
+    """Returns the cells of a column (a Series) as to_csv would write them.
+    
+    alone : x is the only column of the frame (see _codeCells())
+    """
+    dtype = x.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return _codeCells(x.cat.codes.values, x.cat.categories, 
+                          float_format, alone)
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+        a, neg = _signed(x.values)
+        return _intCells(a, neg)
+    if isinstance(dtype, np.dtype) and dtype == np.float64:
+        values = x.values
+        missing = np.isnan(values)
+        if float_format == '%.0f':
+            r = np.rint(np.where(missing, 0, values))
+            if (np.abs(r) < 2. ** 63).all():
+                neg = np.signbit(r) & ~missing
+                return _intCells(np.abs(r).astype(np.uint64), neg, missing)
+        elif float_format is None:
+            cells = _decimalCells(values, missing)
+            if cells is not None:
+                return cells
+        return _csvCells(x, float_format)
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and \
+            dtype.kind in 'iu':       # nullable Int64 and friends
+        missing = x.isna().values
+        a, neg = _signed(x.to_numpy(dtype = np.int64, na_value = 0))
+        return _intCells(a, neg, missing)
+    if dtype == object or dtype == bool or pd.api.types.is_string_dtype(dtype):
+        codes, uniques = pd.factorize(x)
+        return _codeCells(codes, uniques, float_format, alone)
+    return _csvCells(x, float_format)
+
+def formatRows(df, float_format = None, sep = b';'):
+    """Returns the rows of df as raw file text (bytes), see the module doc."""
+    n = len(df)
+    if n == 0:
+        return b''
+    alone = len(df.columns) == 1
+    cells = [_columnCells(df[col], float_format, alone) 
+             for col in df.columns]
+    widths = [B.shape[1] + 1 for B, first, end in cells]
+    M = np.empty((n, sum(widths)), dtype = np.uint8)
+    keep = np.empty(M.shape, dtype = bool)
+    off = 0
+    for (B, first, end), w in zip(cells, widths):
+        pos = np.arange(w - 1)
+        M[:, off:off + w - 1] = B
+        keep[:, off:off + w - 1] = (pos >= first[:, None]) & \
+                                   (pos < end[:, None])
+        M[:, off + w - 1] = ord(sep)
+        keep[:, off + w - 1] = True
+        off += w
+    M[:, -1] = ord('\n')
+    return M[keep].tobytes()
+
+################################################################################
+##  Output
+################################################################################
+class RawWriter(object):
+    """Buffered (optionally compressed) raw file. Use as a context manager.
+
+    Parameters:
+    -----------
+    filename : path or an open file (text or binary; uncompressed only)
+    compression : 'infer' (from the file name: .gz or .zst), None, 'gzip'
+        or 'zstd' (needs the zstandard package)
+    level : compression level (default 6 for gzip, 3 for zstd)
+    threads : compression threads (default: one per core, at most 
+        MAX_THREADS); up to 2 * threads blocks are in flight at a time
+    blocksize : bytes collected before a block is compressed and written
+    """
+    def __init__(self, filename, compression = 'infer', level = None,
+                 threads = None, blocksize = 2 ** 24):
+        self.compression = _compression(filename, compression)
+        self.blocksize = blocksize
+        self.threads = None
+        if self.compression is not None:
+            self.threads = threads or min(MAX_THREADS, 
+                                          multiprocessing.cpu_count())
+        self._own = not hasattr(filename, 'write')
+        if self._own:
+            self._file = open(filename, 'wb', buffering = blocksize)
+        else:
+            self._file = filename
+        self._text = isinstance(self._file, io.TextIOBase)
+        if self._text and self.compression is not None:
+            raise ValueError("Compressed output needs a binary file")
+        self._buffer, self._size = [], 0
+        self._pool, self._pending, self._zstream = None, deque(), None
+        if self.compression == 'gzip':
+            ##  Every block is its own gzip member; readers (gzip, pandas,
+            ##  zcat) read concatenated members as one file.
+            self.level = 6 if level is None else level
+            self._pool = ThreadPoolExecutor(self.threads)
+        elif self.compression == 'zstd':
+            zstd = _zstd()
+            self._zstream = zstd.ZstdCompressor(
+                level = 3 if level is None else level,
+                threads = self.threads).stream_writer(self._file,
+                                                      closefd = False)
+
+    def write(self, data):
+        """Adds data (bytes) to the file."""
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.blocksize:
+            self._flush()
+
+    def _put(self, data):
+        if self._zstream is not None:
+            self._zstream.write(data)
+        elif self._text:
+            self._file.write(data.decode('utf-8'))
+        else:
+            self._file.write(data)
+
+    def _flush(self):
+        block = b''.join(self._buffer)
+        self._buffer, self._size = [], 0
+        if not block:
+            return
+        if self._pool is None:
+            self._put(block)
+            return
+        self._pending.append(self._pool.submit(gzip.compress, block,
+                                               self.level))
+        while len(self._pending) > 2 * self.threads:
+            self._put(self._pending.popleft().result())
+
+    def close(self):
+        """Writes what is left and closes the file (if opened here)."""
+        self._flush()
+        while self._pending:
+            self._put(self._pending.popleft().result())
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._zstream is not None:
+            self._zstream.close()
+            self._zstream = None
+        if self._own:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def writeRaw(df, filename, float_format = None, chunksize = 2 ** 18,
+             compression = 'infer', level = None, threads = None):
+    """Writes df as a raw ';' separated file (no header, " " for missing).
+
+    Parameters:
+    -----------
+    df : dataframe to write
+    filename : path, open file or RawWriter (to append several frames)
+    float_format : None (floats as repr()) or '%.0f' (as integers)
+    chunksize : rows formatted at a time
+    compression, level, threads : see RawWriter
+    """
+    if isinstance(filename, RawWriter):
+        out, own = filename, False
+    else:
+        out = RawWriter(filename, compression = compression, level = level,
+                        threads = threads)
+        own = True
+    try:
+        for start in range(0, len(df), chunksize):
+            out.write(formatRows(df.iloc[start:start + chunksize],
+                                 float_format))
+    finally:
+        if own:
+            out.close()
+
+################################################################################
+##  Input
+################################################################################
+class _InflateStream(io.RawIOBase):
+    """Raw stream of a compressed file, inflated ahead by a worker thread.
+    
+    The thread puts blocks of blocksize inflated bytes on a queue of depth 
+    blocks (zlib and zstd release the GIL while they work) and readinto() 
+    takes them off. Errors of the thread are raised in the reader.
+    """
+    def __init__(self, path, compression, blocksize = 2 ** 22, depth = 4):
+        io.RawIOBase.__init__(self)
+        self._queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._block, self._pos, self._done = b'', 0, False
+        self._thread = threading.Thread(target = self._run, 
+                                        args = (path, compression, blocksize))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout = .1)
+                return
+            except queue.Full:
+                pass
+
+    def _run(self, path, compression, blocksize):
+        try:
+            if compression == 'gzip':
+                f = gzip.open(path, 'rb')
+            else:
+                f = _zstd().ZstdDecompressor().stream_reader(
+                    open(path, 'rb'), read_across_frames = True)
+            with f:
+                while not self._stop.is_set():
+                    data = f.read(blocksize)
+                    self._put(data)
+                    if not data:
+                        return
+        except BaseException as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._block):
+            if self._done:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._done = True
+                raise item
+            if not item:
+                self._done = True
+                return 0
+            self._block, self._pos = item, 0
+        n = min(len(b), len(self._block) - self._pos)
+        b[:n] = self._block[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout = .1)
+                except queue.Empty:
+                    pass
+        io.RawIOBase.close(self)
+
+def openRaw(path, compression = 'infer', blocksize = 2 ** 22, text = False):
+    """Opens a raw file for reading (binary, or text if text = True).
+    
+    Plain files are read with a buffer of blocksize bytes. Compressed files
+    (compression = 'infer' goes by the name: .gz or .zst) are inflated 
+    blocksize bytes at a time in a worker thread while the caller parses.
+    """
+    compression = _compression(path, compression)
+    if compression is None:
+        f = open(path, 'rb', buffering = blocksize)
+    else:
+        f = io.BufferedReader(_InflateStream(path, compression, blocksize),
+                              buffer_size = blocksize)
+    if text:
+        return io.TextIOWrapper(f)
+    return f